@@ -1,5 +1,7 @@
 import chessmasks as cm
+import chesseval as ce
 import datetime as dt
+import random
 
 
 NONE    = 0b0
@@ -31,6 +33,37 @@ letterMap = {"a":0, "b":1, "c":2, "d":3, "e":4, "f":5, "g":6, "h":7}
 letterMapInv = {val: key for key, val in letterMap.items()}
 numSet = set(["1", "2", "3", "4", "5", "6", "7", "8"])
 
+# FEN piece letters, upper case for white
+fenToPiece = {"P": WHITE | PAWN, "N": WHITE | KNIGHT, "B": WHITE | BISHOP,
+              "R": WHITE | ROOK, "Q": WHITE | QUEEN, "K": WHITE | KING,
+              "p": BLACK | PAWN, "n": BLACK | KNIGHT, "b": BLACK | BISHOP,
+              "r": BLACK | ROOK, "q": BLACK | QUEEN, "k": BLACK | KING}
+pieceToFen = {piece: letter for letter, piece in fenToPiece.items()}
+
+DEFAULTFEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1"
+
+
+# ZOBRIST KEYS
+# A position's hash is the XOR of the key for each (piece, square), the turn
+# key when black is to move, and the en passant key of the skipped square's
+# column. Fixed seed, so hashes are the same across runs and processes.
+zobristRandom       = random.Random(0x0A17C4E55)
+
+# zobristPieces[piece][index], indexed by piece code like CompactGamestate
+zobristPieces       = [None] * ((BOTH | ALL) + 1)
+for pieceType in pieceArray:
+    for colour in colourArray:
+        zobristPieces[pieceType | colour] = [zobristRandom.getrandbits(64) for index in range(0,64)]
+
+zobristTurn         = zobristRandom.getrandbits(64)
+zobristEnPassant    = [zobristRandom.getrandbits(64) for col in range(0,8)]
+
+# Key for the en passant boards of both colours
+def enPassantKey(bits):
+    if bits == 0:
+        return 0b0
+    return zobristEnPassant[(bits.bit_length() - 1) % 8]
+
 
 
 class Piece():
@@ -51,12 +84,13 @@ class Piece():
 
 class Move():
         
-    def __init__(self, piece, fromPos, toPos, capBool=False, capPiece=NONE):
+    def __init__(self, piece, fromPos, toPos, capBool=False, capPiece=NONE, promotion=NONE):
         self.piece      = piece
         self.fromPos    = fromPos
         self.toPos      = toPos
         self.capBool    = capBool
         self.capPiece   = capPiece
+        self.promotion  = promotion
         
     def getPiece(self):
         return self.piece
@@ -72,17 +106,56 @@ class Move():
     
     def getCapBool(self):
         return self.capBool
+    
+    # Piece type a pawn is promoted to, NONE if the move is not a promotion
+    def getPromotion(self):
+        return self.promotion
 
     def unpack(self):
         return [self.getPiece(), self.getFromPos(), self.getToPos()]
     
+    # Moves are equal if they move the same piece between the same squares
+    # with the same promotion, so moves from different searches can be matched
+    def __eq__(self, other):
+        if not isinstance(other, Move):
+            return NotImplemented
+        return self.piece == other.piece and self.fromPos == other.fromPos and \
+            self.toPos == other.toPos and self.promotion == other.promotion
+    
+    def __hash__(self):
+        return hash((self.piece, self.fromPos, self.toPos, self.promotion))
+    
     def __str__(self):
         pieceType = getPieceType(self.getPiece())
         capBool = int(self.getCapBool())
         return pieceToLetter(self.getPiece()) +\
             coordsToAlg(self.getFromPos()) +\
             ("x" + pieceToLetter(self.getCapPiece())) * capBool +\
-                coordsToAlg(self.getToPos())
+                coordsToAlg(self.getToPos()) +\
+            ("=" + pieceToLetter(self.getPromotion())) * (self.getPromotion() != NONE)
+
+# Record returned by Gamestate.makeMove, holding everything needed to undo it
+class Undo():
+    
+    def __init__(self, move, capPiece, capBit, turn, enPassantWhite, enPassantBlack, hashKey, evalScore):
+        self.move           = move
+        self.capPiece       = capPiece
+        self.capBit         = capBit
+        self.promotion      = move.getPromotion()
+        self.turn           = turn
+        self.enPassantWhite = enPassantWhite
+        self.enPassantBlack = enPassantBlack
+        self.hashKey        = hashKey
+        self.evalScore      = evalScore
+        
+    def getMove(self):
+        return self.move
+    
+    def getCapPiece(self):
+        return self.capPiece
+    
+    def getPromotion(self):
+        return self.promotion
 
 class Bitboard():
     
@@ -178,68 +251,211 @@ class Bitboard():
         pass
         
     
-class Gamestate():
+# Board keys held by every gamestate: each piece and colour, plus the
+# combined occupancy boards
+boardPieces = [BOTH | ALL] + [pieceType | colour for pieceType in pieceArray + [ALL] for colour in colourArray]
+
+# Position logic shared by Gamestate and CompactGamestate.
+# Subclasses supply the board storage through getBits, setBits, togglePiece,
+# getEnPassant and setEnPassant
+class GamestateBase():
+    
+    __slots__ = ()
     
     def __init__(self):
         
-        self.pieceBitboards  = dict()
-        self.enPassant  = {WHITE: Bitboard(WHITE), BLACK: Bitboard(BLACK)}
         self.turn = WHITE
         
-        self.moves = dict()
-        self.captures = dict()
+        # Undo records of the moves made so far, most recent last
+        self.undoStack = []
         
-        self.pieceBitboards[BOTH | ALL] = Bitboard(BOTH | ALL)
+        # Zobrist hash of the position, kept up to date by every change
+        self.hashKey = 0b0
+        
+        # Legal moves of the side to move, as [moveList, moveMap], or None
+        # until first asked for. Cleared by every change to the position
+        self.legalCache = None
+        
+        # The piece on each square by board index, or NONE, kept in step with
+        # the boards so the piece on a square is one lookup. Piece codes fit
+        # in a byte, so it is a bytearray rather than a list of 64 slots
+        self.mailbox = bytearray(64)
+        
+        # Material and piece-square score from white's view, kept up to date
+        # by every change (see chesseval)
+        self.evalScore = 0
         
-        for pieceType in pieceArray + [ALL]:
-            for colour in colourArray:
-                self.pieceBitboards[pieceType | colour] = Bitboard(pieceType | colour)
-                
-    # Gets bitboard of the specified piece        
-    def getBoard(self, piece):
-        return self.pieceBitboards[piece]
-    
     def getTurnPlayer(self):
         return self.turn
     
     def changeTurnPlayer(self):
         self.turn = invColour(self.turn)
+        self.hashKey ^= zobristTurn
+        self.legalCache = None
+        
+    def getHash(self):
+        return self.hashKey
+    
+    # Computes the Zobrist hash from scratch, to check the incremental one
+    # or after setting boards directly with setBits
+    def computeHash(self):
+        key = 0b0
+        for pieceType in pieceArray:
+            for colour in colourArray:
+                piece   = pieceType | colour
+                keys    = zobristPieces[piece]
+                bits    = self.getBits(piece)
+                while bits:
+                    index = (bits & -bits).bit_length() - 1
+                    key ^= keys[index]
+                    bits &= bits - 1
+                    
+        if self.turn == BLACK:
+            key ^= zobristTurn
+            
+        return key ^ enPassantKey(self.getEnPassant(WHITE) | self.getEnPassant(BLACK))
+    
+    # Fills the mailbox from the piece boards, after setting boards directly
+    # with setBits
+    def rebuildMailbox(self):
+        mailbox = bytearray(64)
+        for pieceType in pieceArray:
+            for colour in colourArray:
+                piece   = pieceType | colour
+                bits    = self.getBits(piece)
+                while bits:
+                    lowBit  = bits & -bits
+                    bits    ^= lowBit
+                    mailbox[lowBit.bit_length() - 1] = piece
+                    
+        self.mailbox = mailbox
+        
+    # Debug check that the mailbox and the piece boards agree. Raises an
+    # Exception naming the first square where they differ, else returns True
+    def checkMailbox(self):
+        for index in range(0, 64):
+            onBoards = [piece for piece in boardPieces[1:] if getPieceType(piece) != ALL and
+                        (self.getBits(piece) >> index) & 0b1]
+            expected = onBoards[0] if len(onBoards) == 1 else NONE
+            
+            if len(onBoards) > 1 or self.mailbox[index] != expected:
+                raise Exception("Mailbox holds {} at {} but the boards hold {}".format(
+                    self.mailbox[index], indexCoords[index], onBoards))
+                
+        return True
     
     # Incase of disparity between piece boards and an "ALL" board
     def updateAlls(self):
+        bothBits = 0b0
         for colour in colourArray:
             bits = 0b0
             for pieceType in pieceArray:
-                bits |= self.getBoard(colour | pieceType)
-                
-            self.getBoard(colour + ALL).setBits(bits)
+                bits |= self.getBits(colour | pieceType)
                 
-    
-    # Returns the bitboard containing all pieces of specified colour
-    def getAll(self, colour=BOTH):
-        return self.pieceBitboards[colour | ALL]
+            self.setBits(colour | ALL, bits)
+            bothBits |= bits
+            
+        self.setBits(BOTH | ALL, bothBits)
     
     # Sets all values to the appropriate value of a new game
     def default(self):
         
         self.turn = WHITE
+        self.undoStack = []
+        self.legalCache = None
         
-        self.getBoard(BOTH + ALL).default()
-        
+        for piece in boardPieces:
+            self.setBits(piece, Bitboard.DEFAULT[piece])
+            
         for colour in colourArray:
-            self.enPassant[colour].default()
+            self.setEnPassant(colour, Bitboard.DEFAULT[colour])
+            
+        self.hashKey = self.computeHash()
+        self.rebuildMailbox()
+        self.evalScore = ce.computeEvalScore(self)
+        
+    # Returns a new gamestate of this class set up from a FEN string
+    @classmethod
+    def fromFEN(cls, fen):
+        gs = cls()
+        gs.setFEN(fen)
+        return gs
+    
+    # Sets the position from a FEN (or the first four fields of an EPD line).
+    # Antichess has no castling, so the castling field is ignored, as are the
+    # move counters. The boards are built as ints and set once each
+    def setFEN(self, fen):
+        
+        fields      = fen.split()
+        bits        = dict.fromkeys(boardPieces, 0b0)
+        row, col    = 0, 0      # FEN starts at a8, which is row 0
+        
+        for char in fields[0]:
+            if char == "/":
+                row, col = row + 1, 0
+            elif char in numSet:
+                col += int(char)
+            else:
+                piece   = fenToPiece[char]
+                bit     = 0b1 << (8*row + (7-col))
+                bits[piece]                 |= bit
+                bits[(piece & 0b11) | ALL]  |= bit
+                col += 1
+                
+        bits[BOTH | ALL] = bits[WHITE | ALL] | bits[BLACK | ALL]
+        
+        for piece in boardPieces:
+            self.setBits(piece, bits[piece])
+        
+        self.turn       = BLACK if len(fields) > 1 and fields[1] == "b" else WHITE
+        self.undoStack  = []
+        self.legalCache = None
+        
+        # The en passant square belongs to the colour that just double stepped
+        self.setEnPassant(WHITE, 0b0)
+        self.setEnPassant(BLACK, 0b0)
+        if len(fields) > 3 and fields[3] != "-":
+            self.setEnPassant(invColour(self.turn), 0b1 << coordsToIndex(algToCoords(fields[3])))
+            
+        self.hashKey = self.computeHash()
+        self.rebuildMailbox()
+        self.evalScore = ce.computeEvalScore(self)
+        
+    # Returns the position as a FEN string. Move counters are not kept, so
+    # they are always written as "0 1"
+    def toFEN(self):
+        
+        rows = []
+        for row in range(0,8):
+            rowText = ""
+            empty   = 0
+            for col in range(0,8):
+                piece = self.getPiece((col, row))
+                if piece == NONE:
+                    empty += 1
+                    continue
+                
+                if empty:
+                    rowText += str(empty)
+                    empty = 0
+                rowText += pieceToFen[piece]
+                
+            rows.append(rowText + (str(empty) if empty else ""))
             
-            for pieceType in pieceArray + [ALL]:
-                self.getBoard(pieceType | colour).default()
+        enPassant = self.getEnPassant(WHITE) | self.getEnPassant(BLACK)
+        enPassantText = coordsToAlg(indexCoords[enPassant.bit_length() - 1]) if enPassant else "-"
+        
+        return "{} {} - {} 0 1".format("/".join(rows), "w" if self.turn == WHITE else "b", enPassantText)
                 
     # Return all moves where a piece can be captured
     def getCaptures(self, piece, pos):
         oppColour = invColour(getColour(piece))
         
         if getPieceType(piece) == PAWN:
-            return cm.getCaptureMask(piece, pos) & self.getAll(oppColour).getBits()
+            targets = self.getBits(oppColour | ALL) | self.getEnPassant(oppColour)
+            return cm.getCaptureMask(piece, pos) & targets
         else:
-            return self.getMoves(piece,pos) & self.getAll(oppColour).getBits()
+            return self.getMoves(piece,pos) & self.getBits(oppColour | ALL)
     
     # returns a binary number corresponding to legal moves for piece at position Pos
     # (Returns an integer number, not a Bitboard)
@@ -250,17 +466,17 @@ class Gamestate():
 
         if pieceType in slidingPieces:
             # print(Bitboard(bits=self.getSlidingMoves(piece,pos)))
-            return self.getSlidingMoves(piece, pos) & ~self.getAll(colour).getBits()
+            return self.getSlidingMoves(piece, pos) & ~self.getBits(colour | ALL)
 
         elif pieceType in staticPieces:
             # print(Bitboard(bits=cm.getCaptureMask(piece, pos)))
-            return cm.getCaptureMask(piece, pos) & ~self.getAll(colour).getBits()
+            return cm.getCaptureMask(piece, pos) & ~self.getBits(colour | ALL)
         
         elif pieceType == PAWN:
-            pawnMask = cm.getMoveMask(piece, pos) & ~self.getAll().getBits()
+            pawnMask = cm.getMoveMask(piece, pos) & ~self.getBits(BOTH | ALL)
             
             if pawnMask != 0 and cm.canDoubleStepPawn(colour, pos):
-                return cm.getDoubleStepPawnMask(colour, pos) & ~self.getAll().getBits()
+                return cm.getDoubleStepPawnMask(colour, pos) & ~self.getBits(BOTH | ALL)
             
             return pawnMask
         
@@ -269,39 +485,82 @@ class Gamestate():
 
     
     # Returns True if colour can capture a piece
-    # (Definitely inefficient)
+    # Pawn captures are tested for all pawns at once by shifting the pawn
+    # board, the other pieces by their attack tables
     def canCapture(self, colour):
         
+        oppColour   = invColour(colour)
+        oppBits     = self.getBits(oppColour | ALL)
+        
+        pawnTargets = oppBits | self.getEnPassant(oppColour)
+        if cm.getPawnAttacks(colour, self.getBits(PAWN | colour)) & pawnTargets:
+            return True
+        
+        occupancy   = self.getBits(BOTH | ALL)
+        attacks     = 0b0
+        
+        for pieceType, table in [(KNIGHT, cm.knightAttackTable), (KING, cm.kingAttackTable)]:
+            bits = self.getBits(pieceType | colour)
+            while bits:
+                lowBit  = bits & -bits
+                bits    ^= lowBit
+                attacks |= table[lowBit.bit_length() - 1]
+                
+        for pieceType in [QUEEN, ROOK, BISHOP]:
+            slidingAttacks = cm.slidingAttackDict[pieceType]
+            bits = self.getBits(pieceType | colour)
+            while bits:
+                lowBit  = bits & -bits
+                bits    ^= lowBit
+                attacks |= slidingAttacks(lowBit.bit_length() - 1, occupancy)
+                
+        return attacks & oppBits != 0
+    
+    # Returns every capture colour can make, or an empty list if there are
+    # none, so the forced capture rule needs only this one pass
+    def getCaptureMoveList(self, colour):
+        
+        oppColour   = invColour(colour)
+        oppBits     = self.getBits(oppColour | ALL)
+        pawnTargets = oppBits | self.getEnPassant(oppColour)
+        occupancy   = self.getBits(BOTH | ALL)
+        
+        captureList = []
         for pieceType in pieceArray:
-            board = self.getBoard(pieceType + colour)
+            piece   = pieceType | colour
+            targets = pawnTargets if pieceType == PAWN else oppBits
+            bits    = self.getBits(piece)
             
-            for i in range(0,8):
-                for j in range(0,8):
-                    
-                    checkBit = board[i,j]
-                    
-                    if checkBit == 1 and self.getCaptures(pieceType + colour, (i,j)) != 0:
-                        
-                        print(Bitboard(bits=self.getCaptures(pieceType+colour, (i,j))))
-                        print("{} AT {} CAN CAPTURE".format(pieceType+colour, (i,j)))
-                        return True
+            while bits:
+                lowBit  = bits & -bits
+                bits    ^= lowBit
+                index   = lowBit.bit_length() - 1
+                
+                captureBits = cm.getAttacks(piece, index, occupancy) & targets
+                if captureBits:
+                    captureList += bitsToMoves(piece, indexCoords[index], captureBits)
                     
-        return False
+        return captureList
 
-    # Returns True if a move is legal, False otherwise
+    # Returns True if a move is legal, False otherwise. For the side to move
+    # this is a bit test on the cached legal move map
     def isLegalMove(self, piece, fromPos, toPos):
         
-        colour = getColour(piece)
-        pieceBoard = self.getBoard(piece)
-        if pieceBoard[fromPos] == 1:
+        colour      = getColour(piece)
+        fromIndex   = coordsToIndex(fromPos)
+        
+        if colour == self.turn:
+            if (self.getBits(piece) >> fromIndex) & 0b1 == 0:
+                return False
+            return (self.getLegalMoveMap().get(fromIndex, 0b0) >> coordsToIndex(toPos)) & 0b1 == 1
+        
+        if (self.getBits(piece) >> fromIndex) & 0b1 == 1:
 
             bits = 0b0
             if self.canCapture(colour):
                 checkBits = self.getCaptures(piece, fromPos)
-                print("CAN CAPTURE")
             else: 
                 checkBits = self.getMoves(piece,fromPos)
-                print("CANNOT CAPTURE")
                 
             index = coordsToIndex(toPos)
             if (checkBits >> index) & 0b1 == 1:
@@ -309,143 +568,220 @@ class Gamestate():
 
         return False
 
+    # The legal moves of the side to move are generated once per position
+    # and shared by every caller; the list returned is the caller's own
     def getLegalMoveList(self, colour, pieces=pieceArray):
+        if colour == self.turn and pieces is pieceArray:
+            cache = self.legalCache
+            if cache is None:
+                cache = self.legalCache = [list(self.generateLegalMoves(colour)), None]
+            return cache[0][:]
         
-        canCap          = self.canCapture(colour)
-        legalMoveList   = []
-        colourBoard     = self.getAll(colour)
-        
-        for i in range(0,8):
-            for j in range(0,8):
-                
-                # If no piece of specified colour is there, skip
-                if colourBoard[i,j] != 1:
-                    continue
-                    
-                for pieceType in pieces:
-                    piece = pieceType + colour
-                    
-                    # Continue until correct piece is found
-                    if self.getBoard(piece)[i,j] != 1:
-                        continue
-                    
-                    
-                    if canCap:
-                        legalMoveBits   = self.getCaptures(piece, (i,j))
-                        legalMoveList   += bitsToMoveList(piece, (i,j), legalMoveBits)
-                    else:
-                        legalMoveBits   = self.getMoves(piece, (i,j))
-                        legalMoveList   += bitsToMoveList(piece, (i,j), legalMoveBits)
+        return list(self.generateLegalMoves(colour, pieces))
+    
+    def getLegalCache(self):
+        if self.legalCache is None:
+            self.legalCache = [list(self.generateLegalMoves(self.turn)), None]
         
-        return legalMoveList
+        return self.legalCache
     
-    # Gets moves for sliding pieces (Queen, Rook, Bishop)
-    def getSlidingMoves(self, piece, coords):
+    # Returns the legal moves of the side to move as a dict from the index
+    # of a square to the bits of the squares its piece can move to
+    def getLegalMoveMap(self):
+        cache = self.getLegalCache()
         
-        # Gets the digits of a binary number after digit "pieceNum"
-        def getLeft(bits, pieceNum):
-            return bits >> pieceNum + 1
+        if cache[1] is None:
+            moveMap = dict()
+            for move in cache[0]:
+                fromIndex = coordsToIndex(move.fromPos)
+                moveMap[fromIndex] = moveMap.get(fromIndex, 0b0) | (0b1 << coordsToIndex(move.toPos))
+            cache[1] = moveMap
+            
+        return cache[1]
+    
+    # Yields the legal moves of colour piece by piece, so callers can stop early.
+    # Only the squares holding pieces are visited
+    def generateLegalMoves(self, colour, pieces=pieceArray):
         
-        # Gets the digits of a binary number up to digit "pieceNum"
-        def getRight(bits, pieceNum):
-            ones = ((0b1 << pieceNum) - 0b1)
-            return bits & ones
+        # Capturing is compulsory whenever any piece can capture
+        captureList = self.getCaptureMoveList(colour)
+        if captureList:
+            for move in captureList:
+                if getPieceType(move.piece) in pieces:
+                    yield move
+            return
         
-        # Reverses the bits of a 64 digit binary number
-        # Example: revBits64(0b1101) = 0b0000...001011
-        def revBits64(bits):
-            revStr = bin(bits)[:1:-1]
-            length = len(revStr)
+        for pieceType in pieces:
+            piece   = pieceType + colour
+            bits    = self.getBits(piece)
             
-            rev = int(revStr, 2) << (64 - length)
-                
-            return rev
-        
-        # 
-        def getSlideFromMask(bits, mask):
-            return ((bits-1) ^ (bits)) & mask
-        
-        pieceNum = coordsToIndex(coords)
-        colour = piece & 0b11
-        bitboardOwn = self.getAll(colour)
-        bitboardAll = self.getAll()
-        # This algorithm needs cleaning up and explaining.
-        # May be more efficient to run along each slide manually
-        
-        final = 0b0
-        #captureMask     = cm.getCaptureMask(piece, coords)
-        for captureMask in cm.getCaptureLines(piece,coords):
-            maskedPieces    = captureMask & bitboardAll.getBits()
-            
-            captureMaskRight    = getRight(captureMask, pieceNum)
-            captureMaskRightRev = revBits64(captureMaskRight)
-            
-            right               = getRight(maskedPieces, pieceNum)
-            rightRev            = revBits64(right)
-            calcRightRev        = getSlideFromMask(rightRev, captureMaskRightRev)
-            calcRight           = revBits64(calcRightRev)
-            
-            captureMaskLeft     = getLeft(captureMask, pieceNum)
-            
-            left                = getLeft(maskedPieces, pieceNum)
-            calcLeft            = getSlideFromMask(left, captureMaskLeft)
-            
-            combined    = calcRight | (calcLeft << (pieceNum + 1) )
-            final       |= combined & ~bitboardOwn.getBits()
+            while bits:
+                lowBit  = bits & -bits
+                bits    ^= lowBit
+                fromPos = indexCoords[lowBit.bit_length() - 1]
+                    
+                yield from bitsToMoves(piece, fromPos, self.getMoves(piece, fromPos))
+    
+    # Gets moves for sliding pieces (Queen, Rook, Bishop)
+    # Attacks are looked up in the precomputed tables in chessmasks, keyed by
+    # square index and the blockers on that square's lines
+    def getSlidingMoves(self, piece, coords):
+        
+        index       = coordsToIndex(coords)
+        colour      = piece & 0b11
+        occupancy   = self.getBits(BOTH | ALL)
         
-        return final
+        return cm.getSlidingAttacks(piece, index, occupancy) & ~self.getBits(colour | ALL)
     
         
-    #Moves piece from fromPos to toPos, and updates the boards and turn player.
+    # Moves piece from fromPos to toPos, and updates the boards and turn player.
+    # Returns an Undo record, which unmakeMove uses to restore the previous state
     def makeMove(self, move, returnString=False):
         
         piece, fromPos, toPos = move.unpack()
+        promotion   = move.getPromotion()
         
-        colour = getColour(piece)
+        colour      = getColour(piece)
+        oppColour   = invColour(colour)
         
-        pieceBoard = self.getBoard(piece)
+        fromIndex   = coordsToIndex(fromPos)
+        toIndex     = coordsToIndex(toPos)
+        fromBit     = 0b1 << fromIndex
+        toBit       = 0b1 << toIndex
         
-        if pieceBoard[fromPos] == 0:
+        if self.getBits(piece) & fromBit == 0:
             raise Exception("There is no piece of type {} at position {}".format(bin(piece), fromPos))
             
-        if self.getAll(colour) == 1:
+        if self.getBits(colour | ALL) & toBit != 0:
             raise Exception("There is already a piece of colour {} at position {}".format(bin(colour), toPos))
             
-
-        # Code for capturing pieces 
-        # This could be handled more efficiently by specifying the capture board. Will rethink later
-        oppColour = invColour(colour)
-        for oppPieceType in pieceArray:
-            oppBoard = self.getBoard(oppPieceType | oppColour)
-            if oppBoard[toPos] == 1:
-                self[oppPieceType + oppColour, toPos[0], toPos[1]] = 0
-                    
-        self[piece, fromPos[0], fromPos[1]] = 0
-        self[piece, toPos[0], toPos[1]]   = 1
+        # Find the captured piece. An en passant capture takes the pawn
+        # behind the target square rather than on it
+        capPiece    = NONE
+        capBit      = toBit
+        isPawn      = getPieceType(piece) == PAWN
+        
+        mailbox     = self.mailbox
+        
+        if self.getBits(oppColour | ALL) & toBit:
+            capPiece = mailbox[toIndex]
+                
+        elif isPawn and self.getEnPassant(oppColour) & toBit:
+            capPiece    = PAWN | oppColour
+            capBit      = toBit << 8 if oppColour == BLACK else toBit >> 8
+            mailbox[capBit.bit_length() - 1] = NONE
+            
+        enPassantWhite  = self.getEnPassant(WHITE)
+        enPassantBlack  = self.getEnPassant(BLACK)
+        
+        undo = Undo(move, capPiece, capBit, self.turn, enPassantWhite, enPassantBlack, self.hashKey, self.evalScore)
+        scores = ce.signedScores
+        
+        evalScore = self.evalScore - scores[piece][fromIndex]
         
+        key = self.hashKey ^ enPassantKey(enPassantWhite | enPassantBlack)
+        
+        if capPiece != NONE:
+            self.togglePiece(capPiece, capBit)
+            key ^= zobristPieces[capPiece][capBit.bit_length() - 1]
+            evalScore -= scores[capPiece][capBit.bit_length() - 1]
+        
+        self.togglePiece(piece, fromBit)
+        key ^= zobristPieces[piece][fromIndex]
+        
+        if promotion != NONE:
+            self.togglePiece(promotion | colour, toBit)
+            key ^= zobristPieces[promotion | colour][toIndex]
+            mailbox[toIndex] = promotion | colour
+            evalScore += scores[promotion | colour][toIndex]
+        else:
+            self.togglePiece(piece, toBit)
+            key ^= zobristPieces[piece][toIndex]
+            mailbox[toIndex] = piece
+            evalScore += scores[piece][toIndex]
+        mailbox[fromIndex] = NONE
+        self.evalScore = evalScore
+        
+        # A double step leaves the skipped square open to en passant for one turn
+        self.setEnPassant(WHITE, 0b0)
+        self.setEnPassant(BLACK, 0b0)
+        if isPawn and abs(fromIndex - toIndex) == 16:
+            enPassantBit = 0b1 << ((fromIndex + toIndex) // 2)
+            self.setEnPassant(colour, enPassantBit)
+            key ^= enPassantKey(enPassantBit)
+        
+        self.hashKey = key
         self.changeTurnPlayer()
+        self.undoStack.append(undo)
                     
+        # Long algebraic notation, e.g. "Nb1xc3"
         if returnString == True:
-            return pieceToLetter[piece] + coordsToAlg(fromPos) + "x" * int(capture) + coordsToAlg(toPos)
+            return pieceToLetter(piece) + coordsToAlg(fromPos) + "x" * (capPiece != NONE) + \
+                coordsToAlg(toPos) + ("=" + pieceToLetter(promotion)) * (promotion != NONE)
+        
+        return undo
+    
+    # Reverts the most recent move. If undo is given it must be the record
+    # returned by that move's makeMove
+    def unmakeMove(self, undo=None):
+        
+        if len(self.undoStack) == 0:
+            raise Exception("There is no move to unmake")
+        if undo is not None and undo is not self.undoStack[-1]:
+            raise Exception("Only the most recent move can be unmade")
+        
+        undo = self.undoStack.pop()
+        
+        piece, fromPos, toPos = undo.move.unpack()
+        colour      = getColour(piece)
+        fromIndex   = coordsToIndex(fromPos)
+        toIndex     = coordsToIndex(toPos)
+        fromBit     = 0b1 << fromIndex
+        toBit       = 0b1 << toIndex
+        mailbox     = self.mailbox
+        
+        if undo.promotion != NONE:
+            self.togglePiece(undo.promotion | colour, toBit)
+        else:
+            self.togglePiece(piece, toBit)
+        self.togglePiece(piece, fromBit)
+        mailbox[toIndex]    = NONE
+        mailbox[fromIndex]  = piece
+        
+        if undo.capPiece != NONE:
+            self.togglePiece(undo.capPiece, undo.capBit)
+            mailbox[undo.capBit.bit_length() - 1] = undo.capPiece
+            
+        self.setEnPassant(WHITE, undo.enPassantWhite)
+        self.setEnPassant(BLACK, undo.enPassantBlack)
+        self.turn       = undo.turn
+        self.hashKey    = undo.hashKey
+        self.evalScore  = undo.evalScore
+        self.legalCache = None
         
     # Promotes a pawn in position pos to a piece of type pieceType
+    # If the pawn has just moved there, the promotion is added to that move's
+    # Undo record so unmakeMove reverts both together
     def promotePiece(self, colour, pieceType, pos):
-        pawnBoard       = self.getBoard(colour + PAWN)
-        promoteBoard    = self.getBoard(colour + pieceType)
+        index   = coordsToIndex(pos)
+        bit     = 0b1 << index
+        
+        self.togglePiece(colour | PAWN, bit)
+        self.togglePiece(colour | pieceType, bit)
+        self.hashKey ^= zobristPieces[colour | PAWN][index] ^ zobristPieces[colour | pieceType][index]
+        self.legalCache = None
+        self.mailbox[index] = colour | pieceType
+        self.evalScore += ce.signedScores[colour | pieceType][index] - ce.signedScores[colour | PAWN][index]
         
-        pawnBoard[pos]      = 0
-        promoteBoard[pos]   = 1
+        if len(self.undoStack) != 0:
+            lastUndo = self.undoStack[-1]
+            lastPiece, _, lastToPos = lastUndo.move.unpack()
+            if lastPiece == colour | PAWN and lastToPos == pos and lastUndo.promotion == NONE:
+                lastUndo.promotion = pieceType
         
     #returns the piece in position pos
     def getPiece(self, pos):
-        i,j = pos
-        for pieceType in pieceArray:
-            for colour in colourArray:
-
-                if self.getBoard(pieceType + colour)[i,j] == 1:
-                    return pieceType + colour
-
-        return NONE
+        return self.mailbox[coordsToIndex(pos)]
 
     # args: piece, xPos, yPos
     # sets the value at (xPos, yPos) on piece's Bitboard to val
@@ -456,15 +792,25 @@ class Gamestate():
             raise Exception("Value must be 0 or 1, {} was given".format(val))
             
         piece, *pos = args
-        colour = getColour(piece)
+        colour  = getColour(piece)
+        index   = coordsToIndex(pos)
+        bit     = 0b1 << index
         
-        board       = self.getBoard(piece)
-        boardColAll = self.getAll(colour)
-        boardAll    = self.getAll()
+        if (self.getBits(piece) >> index) & 0b1 != val:
+            self.hashKey ^= zobristPieces[piece][index]
+            self.evalScore += ce.signedScores[piece][index] if val == 1 else -ce.signedScores[piece][index]
+            self.legalCache = None
         
-        board[pos]          = val
-        boardColAll[pos]    = val
-        boardAll[pos]       = val
+        if val == 1:
+            self.mailbox[index] = piece
+        elif self.mailbox[index] == piece:
+            self.mailbox[index] = NONE
+            
+        for board in [piece, colour | ALL, BOTH | ALL]:
+            if val == 1:
+                self.setBits(board, self.getBits(board) | bit)
+            else:
+                self.setBits(board, self.getBits(board) & ~bit)
     
     # args: piece, xPos, yPos
     def __getitem__(self, args):
@@ -472,13 +818,131 @@ class Gamestate():
             raise Exception("3 arguments should be given; Piece, xPos, and yPos. {} were given".format(len(args)))
             
         piece, *pos = args    
-        board = self.getBoard(piece)
         
-        return board[pos]
+        return (self.getBits(piece) >> coordsToIndex(pos)) & 0b1
     
     def __str__(self):
         pass
 
+
+# Gamestate holding one Bitboard object per piece, colour and ALL board
+class Gamestate(GamestateBase):
+    
+    def __init__(self):
+        
+        self.pieceBitboards  = dict()
+        self.enPassant  = {WHITE: Bitboard(WHITE), BLACK: Bitboard(BLACK)}
+        
+        self.moves = dict()
+        self.captures = dict()
+        
+        for piece in boardPieces:
+            self.pieceBitboards[piece] = Bitboard(piece)
+            
+        super().__init__()
+                
+    # Gets bitboard of the specified piece        
+    def getBoard(self, piece):
+        return self.pieceBitboards[piece]
+    
+    # Returns the bitboard containing all pieces of specified colour
+    def getAll(self, colour=BOTH):
+        return self.pieceBitboards[colour | ALL]
+    
+    # Gets the integer bits of the specified piece's board
+    def getBits(self, piece):
+        return self.pieceBitboards[piece].bits
+    
+    def setBits(self, piece, bits):
+        self.pieceBitboards[piece].bits = bits
+    
+    # Flips the square(s) in bit on the piece's board and on the matching
+    # colour and ALL boards. Applying it twice restores the boards.
+    def togglePiece(self, piece, bit):
+        boards = self.pieceBitboards
+        boards[piece].bits              ^= bit
+        boards[(piece & 0b11) | ALL].bits ^= bit
+        boards[BOTH | ALL].bits         ^= bit
+        
+    # Gets the square a pawn of colour skipped with a double step last move
+    def getEnPassant(self, colour):
+        return self.enPassant[colour].bits
+    
+    def setEnPassant(self, colour, bits):
+        self.enPassant[colour].bits = bits
+        
+    # Returns an independent copy of the position and its undo history
+    def copy(self):
+        new = Gamestate()
+        
+        for piece in boardPieces:
+            new.setBits(piece, self.getBits(piece))
+        for colour in colourArray:
+            new.setEnPassant(colour, self.getEnPassant(colour))
+            
+        new.turn        = self.turn
+        new.undoStack   = self.undoStack[:]
+        new.hashKey     = self.hashKey
+        new.legalCache  = None
+        new.mailbox     = self.mailbox[:]
+        new.evalScore   = self.evalScore
+        
+        return new
+    
+
+# Gamestate holding every board as an int in one list, indexed directly by
+# piece code (WHITE | PAWN etc.). The unused codes WHITE | NONE and
+# BLACK | NONE hold the en passant boards, so the whole position is one
+# list and copy() is a single slice.
+class CompactGamestate(GamestateBase):
+    
+    __slots__ = ("boards", "turn", "undoStack", "hashKey", "legalCache", "mailbox", "evalScore")
+    
+    def __init__(self):
+        
+        self.boards = [0b0] * ((BOTH | ALL) + 1)
+        
+        super().__init__()
+        
+    # Returns a Bitboard snapshot of the piece's board. Changing it does not
+    # change the gamestate
+    def getBoard(self, piece):
+        return Bitboard(piece, self.boards[piece])
+    
+    def getAll(self, colour=BOTH):
+        return Bitboard(colour | ALL, self.boards[colour | ALL])
+    
+    def getBits(self, piece):
+        return self.boards[piece]
+    
+    def setBits(self, piece, bits):
+        self.boards[piece] = bits
+        
+    def togglePiece(self, piece, bit):
+        boards = self.boards
+        boards[piece]               ^= bit
+        boards[(piece & 0b11) | ALL] ^= bit
+        boards[BOTH | ALL]          ^= bit
+        
+    def getEnPassant(self, colour):
+        return self.boards[colour]
+    
+    def setEnPassant(self, colour, bits):
+        self.boards[colour] = bits
+        
+    def copy(self):
+        new = CompactGamestate.__new__(CompactGamestate)
+        
+        new.boards      = self.boards[:]
+        new.turn        = self.turn
+        new.undoStack   = self.undoStack[:]
+        new.hashKey     = self.hashKey
+        new.legalCache  = None
+        new.mailbox     = self.mailbox[:]
+        new.evalScore   = self.evalScore
+        
+        return new
+
 def invColour(colour):
     return ~colour & 0b11
 
@@ -500,30 +964,71 @@ def coordsToIndex(coords):
         return 8*row + (7-col)
     raise Exception("2 co-ordinates required, {} given.".format(len(coords)))
     
+# Row 0 is black's back row, so it is rank 8
 def coordsToAlg(coords):
     if len(coords) == 2:
         col, row = coords
-        return letterMapInv[row] + str(col+1)
+        return letterMapInv[col] + str(8-row)
 
     raise Exception("2 co-ordinates required, {} given".format(len(coords)))
 
+def algToCoords(alg):
+    if len(alg) == 2 and alg[0] in letterMap and alg[1] in numSet:
+        return (letterMap[alg[0]], 8 - int(alg[1]))
+    
+    raise Exception("{} is not a valid square on a chess board".format(alg))
+
+# Writes move as from and to squares, plus the promotion letter, e.g. "e2e4", "b7b8q"
+def moveToCoordString(move):
+    return coordsToAlg(move.getFromPos()) + coordsToAlg(move.getToPos()) + \
+        pieceToLetter(move.getPromotion()).lower()
+
+# Packs move into a small int: from index (6 bits), to index (6 bits) and
+# promotion (3 bits, 0 for none, else 1 + its place in promotePieces), the
+# layout of chesspgn.encodeMove
+def moveToCode(move):
+    promotion = 0
+    if move.promotion != NONE:
+        promotion = 1 + promotePieces.index(move.promotion)
+
+    return coordsToIndex(move.fromPos) | (coordsToIndex(move.toPos) << 6) | (promotion << 12)
+
+# Returns the legal move in gs written as text by moveToCoordString
+def coordStringToMove(gs, text):
+    for move in gs.getLegalMoveList(gs.getTurnPlayer()):
+        if moveToCoordString(move) == text:
+            return move
+        
+    raise Exception("{} is not a legal move".format(text))
+
 def indexToCoords(index):
     row = index // 8
     col = 7 - (index % 8)
 
     return (col, row)
 
+# Board index <-> co-ordinates, precomputed for every square
+indexCoords = [indexToCoords(index) for index in range(0,64)]
+coordsIndex = {coords: index for index, coords in enumerate(indexCoords)}
+
+# Yields a Move for each set bit of bits, visiting only the set bits.
+# Pawns reaching the last row give one move per piece in promotePieces
+def bitsToMoves(piece, fromPos, bits):
+    isPawn = getPieceType(piece) == PAWN
+    
+    while bits:
+        lowBit  = bits & -bits
+        bits    ^= lowBit
+        toPos   = indexCoords[lowBit.bit_length() - 1]
+        
+        if isPawn and (toPos[1] == 0 or toPos[1] == 7):
+            for promotion in promotePieces:
+                yield Move(piece, fromPos, toPos, promotion=promotion)
+        else:
+            yield Move(piece, fromPos, toPos)
+
 def bitsToMoveList(piece, fromPos, bits):
-    moveList = []
-    
-    for index in range(0,64):
-        bit = (bits >> index) & 0b1
-        if bit == 1:
-            toPos = indexToCoords(index)
-            newMove = Move(piece, fromPos, toPos)
-            moveList.append(newMove)
-            
-    return moveList
+    return list(bitsToMoves(piece, fromPos, bits))
 
 def pieceToLetter(piece):
     
@@ -531,6 +1036,28 @@ def pieceToLetter(piece):
     pieceType           = getPieceType(piece)
     
     return pieceToLetterMap[pieceType]
+
+# Yields a gamestate for each FEN or EPD line of the text file fenFile,
+# reading one line at a time. Blank lines and lines starting with # are
+# skipped. With reuse, one gamestate is set up again for every line, so the
+# caller must finish with each position before asking for the next
+def loadFENs(fenFile, gamestateClass=None, reuse=False):
+    
+    if gamestateClass is None:
+        gamestateClass = CompactGamestate
+        
+    gs = gamestateClass()
+    
+    for line in fenFile:
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        
+        if not reuse:
+            gs = gamestateClass()
+        gs.setFEN(line)
+        
+        yield gs
     
 
 # test = Bitboard(WHITE + PAWN)
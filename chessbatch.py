@@ -0,0 +1,160 @@
+import chess
+import chessmasks as cm
+import numpy as np
+
+
+# Batched move generation: many positions held as rows of a (N, 12) uint64
+# array, with every operation applied to all rows at once by vectorized
+# shifts and masks. Board indices are the same as in chess.py, 8*y + (7-x).
+
+# Column of each piece in the boards array: white pieces, then black
+batchPieces     = [pieceType | colour for colour in chess.colourArray for pieceType in chess.pieceArray]
+pieceColumn     = {piece: column for column, piece in enumerate(batchPieces)}
+
+def toArray(bits):
+    return np.uint64(bits)
+
+# Masks from chessmasks, as uint64
+notColLeft      = toArray(cm.fullMask & ~cm.vertMask[0])                    # x != 0
+notColRight     = toArray(cm.fullMask & ~cm.vertMask[7])                    # x != 7
+notColsLeft     = toArray(cm.fullMask & ~(cm.vertMask[0] | cm.vertMask[1])) # x > 1
+notColsRight    = toArray(cm.fullMask & ~(cm.vertMask[6] | cm.vertMask[7])) # x < 6
+pawnPushRow     = {chess.WHITE: toArray(cm.horizMask[5]), chess.BLACK: toArray(cm.horizMask[2])}
+
+shift = [np.uint64(n) for n in range(0, 18)]
+
+# One step in each direction, dropping pieces that would wrap round the board.
+# Up the board (y - 1) is a right shift by 8
+def stepUp(b):          return b >> shift[8]
+def stepDown(b):        return b << shift[8]
+def stepRight(b):       return (b & notColRight) >> shift[1]
+def stepLeft(b):        return (b & notColLeft) << shift[1]
+def stepUpRight(b):     return (b & notColRight) >> shift[9]
+def stepUpLeft(b):      return (b & notColLeft) >> shift[7]
+def stepDownRight(b):   return (b & notColRight) << shift[7]
+def stepDownLeft(b):    return (b & notColLeft) << shift[9]
+
+rookSteps       = [stepUp, stepDown, stepRight, stepLeft]
+bishopSteps     = [stepUpRight, stepUpLeft, stepDownRight, stepDownLeft]
+
+def knightAttacks(knights):
+    right1  = knights & notColRight
+    left1   = knights & notColLeft
+    right2  = knights & notColsRight
+    left2   = knights & notColsLeft
+
+    return (right1 >> shift[17]) | (left1 >> shift[15]) | (right1 << shift[15]) | (left1 << shift[17]) | \
+        (right2 >> shift[10]) | (left2 >> shift[6]) | (right2 << shift[6]) | (left2 << shift[10])
+
+def kingAttacks(kings):
+    sides   = stepRight(kings) | stepLeft(kings)
+    row     = kings | sides
+    return sides | stepUp(row) | stepDown(row)
+
+# Flood from the sliders along each step direction until a blocker, which
+# is included (Dumb7Fill)
+def slidingAttacks(sliders, occupancy, steps):
+    empty   = ~occupancy
+    attacks = np.zeros_like(sliders)
+
+    for step in steps:
+        flood   = sliders
+        ray     = sliders
+        for _ in range(0, 6):
+            ray     = step(ray) & empty
+            flood   = flood | ray
+        attacks |= step(flood)
+
+    return attacks
+
+def pawnAttacks(colour, pawns):
+    if colour == chess.WHITE:
+        return stepUpLeft(pawns) | stepUpRight(pawns)
+    return stepDownLeft(pawns) | stepDownRight(pawns)
+
+
+class PositionBatch():
+
+    # boards is (N, 12) uint64 in batchPieces order, turns (N,) of
+    # chess.WHITE/BLACK, enPassant (N, 2) uint64 for white and black
+    def __init__(self, boards, turns, enPassant):
+        self.boards     = boards
+        self.turns      = turns
+        self.enPassant  = enPassant
+
+    @classmethod
+    def fromGamestates(cls, gamestates):
+        gamestates  = list(gamestates)
+        boards      = np.array([[gs.getBits(piece) for piece in batchPieces] for gs in gamestates], dtype=np.uint64)
+        turns       = np.array([gs.getTurnPlayer() for gs in gamestates], dtype=np.uint8)
+        enPassant   = np.array([[gs.getEnPassant(chess.WHITE), gs.getEnPassant(chess.BLACK)] for gs in gamestates],
+                               dtype=np.uint64)
+
+        return cls(boards.reshape(-1, 12), turns, enPassant.reshape(-1, 2))
+
+    @classmethod
+    def fromFENs(cls, fens):
+        return cls.fromGamestates(chess.CompactGamestate.fromFEN(fen) for fen in fens)
+
+    def __len__(self):
+        return len(self.turns)
+
+    def getBits(self, piece):
+        return self.boards[:, pieceColumn[piece]]
+
+    def getAll(self, colour):
+        column = 0 if colour == chess.WHITE else 6
+        return np.bitwise_or.reduce(self.boards[:, column:column + 6], axis=1)
+
+    def getOccupancy(self):
+        return np.bitwise_or.reduce(self.boards, axis=1)
+
+    def getEnPassant(self, colour):
+        return self.enPassant[:, 0 if colour == chess.WHITE else 1]
+
+    # Single and double pawn steps of colour, for every position
+    def pawnPushes(self, colour):
+        pawns = self.getBits(chess.PAWN | colour)
+        empty = ~self.getOccupancy()
+
+        if colour == chess.WHITE:
+            single = stepUp(pawns) & empty
+            return single | (stepUp(single & pawnPushRow[colour]) & empty)
+
+        single = stepDown(pawns) & empty
+        return single | (stepDown(single & pawnPushRow[colour]) & empty)
+
+    # Squares colour's pawns can capture on, en passant included
+    def pawnCaptures(self, colour):
+        oppColour   = chess.invColour(colour)
+        targets     = self.getAll(oppColour) | self.getEnPassant(oppColour)
+
+        return pawnAttacks(colour, self.getBits(chess.PAWN | colour)) & targets
+
+    def knightAttacks(self, colour):
+        return knightAttacks(self.getBits(chess.KNIGHT | colour))
+
+    def kingAttacks(self, colour):
+        return kingAttacks(self.getBits(chess.KING | colour))
+
+    def slidingAttacks(self, colour):
+        occupancy   = self.getOccupancy()
+        queens      = self.getBits(chess.QUEEN | colour)
+        rooks       = self.getBits(chess.ROOK | colour) | queens
+        bishops     = self.getBits(chess.BISHOP | colour) | queens
+
+        return slidingAttacks(rooks, occupancy, rookSteps) | slidingAttacks(bishops, occupancy, bishopSteps)
+
+    # Union of the attacks of colour's pieces other than pawns
+    def pieceAttacks(self, colour):
+        return self.knightAttacks(colour) | self.kingAttacks(colour) | self.slidingAttacks(colour)
+
+    # True for each position where colour can capture
+    def canCaptureColour(self, colour):
+        oppBits = self.getAll(chess.invColour(colour))
+        return ((self.pieceAttacks(colour) & oppBits) | self.pawnCaptures(colour)) != 0
+
+    # True for each position where the side to move is forced to capture
+    def canCapture(self):
+        return np.where(self.turns == chess.WHITE,
+                        self.canCaptureColour(chess.WHITE), self.canCaptureColour(chess.BLACK))
@@ -0,0 +1,176 @@
+import chess
+import chesspgn
+import mmap
+import random
+import struct
+import sys
+
+
+# Opening books. A book file is a header followed by fixed size entries of
+# (position hash, move, weight), sorted by hash, so it is searched in place
+# with no parsing when opened:
+#   key         64 bits, chess.GamestateBase.getHash of the position
+#   move        16 bits, chesspgn.encodeMove of the move
+#   weight      16 bits, higher is played more often
+
+HEADER  = struct.Struct("<4sI")     # magic, number of entries
+ENTRY   = struct.Struct("<QHH")
+MAGIC   = b"ACBK"
+
+# Plies of each game added to a book
+BOOKPLIES = 16
+
+# Points for a move by its game's result, from the side that played it
+WINPOINTS   = 2
+DRAWPOINTS  = 1
+
+MAXWEIGHT = 0xFFFF
+
+
+# BUILDING
+
+# Adds the first maxPlies moves of each game to moveWeights, a dict from
+# position hash to a dict from move code to weight. Returns it
+def addGames(games, maxPlies=BOOKPLIES, moveWeights=None):
+
+    if moveWeights is None:
+        moveWeights = dict()
+
+    for headers, moves, result in games:
+        gs = chess.CompactGamestate()
+        gs.default()
+
+        for text in moves[:maxPlies]:
+            colour = gs.getTurnPlayer()
+
+            if result == "1/2-1/2":
+                points = DRAWPOINTS
+            elif result == ("1-0" if colour == chess.WHITE else "0-1"):
+                points = WINPOINTS
+            else:
+                points = 0
+
+            weights = moveWeights.setdefault(gs.getHash(), dict())
+            code    = chesspgn.encodeMove(text)
+            weights[code] = weights.get(code, 0) + points
+
+            gs.makeMove(chess.coordStringToMove(gs, text))
+
+    return moveWeights
+
+# Writes moveWeights as a book file. Moves with no weight are left out, and
+# the weights of a position are scaled down together if any is too large
+def writeBook(bookFile, moveWeights):
+
+    entries = []
+    for key in sorted(moveWeights):
+        weights = moveWeights[key]
+        scale   = max(1, -(-max(weights.values()) // MAXWEIGHT))
+
+        for code, weight in sorted(weights.items(), key=lambda item: item[1], reverse=True):
+            if weight // scale > 0:
+                entries.append(ENTRY.pack(key, code, weight // scale))
+
+    bookFile.write(HEADER.pack(MAGIC, len(entries)))
+    bookFile.write(b"".join(entries))
+
+    return len(entries)
+
+# Builds a book file from game record files, PGN or chesspgn's binary format
+# if their names end in .bin
+def buildBook(bookPath, gamePaths, maxPlies=BOOKPLIES):
+
+    moveWeights = dict()
+    for gamePath in gamePaths:
+        if gamePath.endswith(".bin"):
+            with open(gamePath, "rb") as gameFile:
+                addGames(chesspgn.readBinary(gameFile), maxPlies, moveWeights)
+        else:
+            with open(gamePath) as gameFile:
+                addGames(chesspgn.readPgn(gameFile), maxPlies, moveWeights)
+
+    with open(bookPath, "wb") as bookFile:
+        return writeBook(bookFile, moveWeights)
+
+
+# PROBING
+
+class OpeningBook():
+
+    def __init__(self, bookPath):
+        with open(bookPath, "rb") as bookFile:
+            self.data = mmap.mmap(bookFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.size = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise Exception("{} is not an opening book".format(bookPath))
+
+    def __len__(self):
+        return self.size
+
+    def getKey(self, entry):
+        return ENTRY.unpack_from(self.data, HEADER.size + ENTRY.size * entry)[0]
+
+    # Returns [(move, weight)] for the position gs, best first. Moves that are
+    # not legal, from a hash collision, are left out
+    def getMoves(self, gs):
+
+        key = gs.getHash()
+
+        # Binary search for the first entry with the key
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.getKey(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        legalMoves = None
+        bookMoves = []
+        for entry in range(low, self.size):
+            entryKey, code, weight = ENTRY.unpack_from(self.data, HEADER.size + ENTRY.size * entry)
+            if entryKey != key:
+                break
+
+            if legalMoves is None:
+                legalMoves = gs.getLegalMoveList(gs.getTurnPlayer())
+
+            text = chesspgn.decodeMove(code)
+            for move in legalMoves:
+                if chess.moveToCoordString(move) == text:
+                    bookMoves.append((move, weight))
+                    break
+
+        return bookMoves
+
+    # Returns a book move for gs, chosen at random in proportion to the
+    # weights (or the heaviest with best), or None if gs is not in the book
+    def getMove(self, gs, best=False):
+
+        bookMoves = self.getMoves(gs)
+        if len(bookMoves) == 0:
+            return None
+        if best:
+            return bookMoves[0][0]
+
+        moves, weights = zip(*bookMoves)
+        return random.choices(moves, weights)[0]
+
+    def close(self):
+        self.data.close()
+
+
+# python chessbook.py bookFile gameFile [gameFile ...] [--plies n]
+if __name__ == "__main__":
+
+    args        = sys.argv[1:]
+    maxPlies    = BOOKPLIES
+
+    if "--plies" in args:
+        at          = args.index("--plies")
+        maxPlies    = int(args[at + 1])
+        args        = args[:at] + args[at + 2:]
+
+    count = buildBook(args[0], args[1:], maxPlies)
+    print("{} entries written to {}".format(count, args[0]))
@@ -1,15 +1,450 @@
 import chess
+import chesseval
+import chesstable
 import random
+import time
 
 
 def getRandomMove(gs):
-    
+
     colour      = gs.getTurnPlayer()
     legalMoves  = gs.getLegalMoveList(colour)
-    
+
     randMove    = random.choice(legalMoves)
-    
+
     return randMove
 
+# Returns the captures the side to move is forced to choose from, or an empty
+# list if it cannot capture
 def forceCapture(gs):
-    pass
\ No newline at end of file
+    return gs.getCaptureMoveList(gs.getTurnPlayer())
+
+
+# SEARCH
+
+# Score for the side to move having won. Wins found sooner score higher:
+# a win in n plies scores WIN - n
+WIN         = 100000
+INFINITY    = WIN + 1
+
+MAXDEPTH        = 64
+DEFAULTDEPTH    = 4
+
+# Nodes between checks of the clock. A node costs far more than reading the
+# clock, so it is checked often enough to keep timed searches close to their
+# limit
+TIMECHECKNODES  = 32
+
+# Quiescence search follows forced captures from each leaf for at most this
+# many plies and nodes, after which the static score is used
+MAXQUIESCEDEPTH = 8
+MAXQUIESCENODES = 32
+
+# Scores this close to WIN are wins found by search, not evaluations
+def isWinScore(score):
+    return abs(score) >= WIN - MAXDEPTH * 2
+
+# Wins are stored in the transposition table relative to the node they were
+# found at, and converted back using the ply they are probed at
+def scoreToTable(score, ply):
+    if isWinScore(score):
+        return score + ply if score > 0 else score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    if isWinScore(score):
+        return score - ply if score > 0 else score + ply
+    return score
+
+# Score of a chesstablebase value probed ply plies from the root
+def tablebaseScore(code, ply):
+    if code > 0:
+        return WIN - ply - (code - 1)
+    if code < 0:
+        return -(WIN - ply - (-code - 1))
+    return 0
+
+def countBits(bits):
+    return bin(bits).count("1")
+
+# Static score of gs for the side to move (see chesseval)
+def evaluate(gs):
+    return chesseval.evaluate(gs)
+
+
+# MOVE ORDERING
+
+# Piece values for ranking captures. The king is a plain piece in antichess,
+# so it is valued low
+orderValues = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300,
+               chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 200}
+
+HASHMOVESCORE   = 1 << 30
+CAPTURESCORE    = 1 << 24
+KILLERSCORE     = 1 << 20
+
+# Orders moves for alpha-beta: the hash move first, then captures by most
+# valuable victim / least valuable attacker, then killer moves of the ply,
+# then the rest by history score
+class MoveOrderer():
+    
+    def __init__(self, maxPly=MAXDEPTH * 2):
+        self.maxPly = maxPly
+        self.clear()
+        
+    def clear(self):
+        # Two killer moves per ply: quiet moves that caused a cutoff there
+        self.killers = [[None, None] for ply in range(0, self.maxPly)]
+        
+        # history[piece][toIndex], raised each time the move causes a cutoff
+        self.history = [[0] * 64 for piece in range(0, (chess.BOTH | chess.ALL) + 1)]
+        
+    # Keeps what was learned about good moves, but lets new searches outweigh it
+    def age(self):
+        self.killers = [[None, None] for ply in range(0, self.maxPly)]
+        for pieceHistory in self.history:
+            for index in range(0, 64):
+                pieceHistory[index] >>= 1
+                
+    # Returns moves sorted best first. hashMove is a chess.moveToCode int
+    def orderMoves(self, gs, moves, ply, hashMove=None):
+        
+        oppColour   = chess.invColour(gs.getTurnPlayer())
+        oppBits     = gs.getBits(oppColour | chess.ALL)
+        targetBits  = oppBits | gs.getEnPassant(oppColour)
+        killers     = self.killers[ply] if ply < self.maxPly else [None, None]
+        
+        scored = []
+        for move in moves:
+            piece       = move.piece
+            toIndex     = chess.coordsToIndex(move.toPos)
+            toBit       = 0b1 << toIndex
+            
+            if hashMove is not None and chess.moveToCode(move) == hashMove:
+                score = HASHMOVESCORE
+            
+            elif toBit & targetBits:
+                victim = chess.PAWN
+                if toBit & oppBits:
+                    victim = chess.getPieceType(gs.mailbox[toIndex])
+                        
+                score = CAPTURESCORE + 16 * orderValues[victim] - orderValues[chess.getPieceType(piece)] // 16
+                
+            elif move == killers[0] or move == killers[1]:
+                score = KILLERSCORE
+                
+            else:
+                score = self.history[piece][toIndex]
+                
+            scored.append((score, move))
+            
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        
+        return [move for score, move in scored]
+    
+    # Records a move that caused a beta cutoff. Captures are already ordered
+    # first, so only quiet moves are remembered
+    def recordCutoff(self, gs, move, ply, depth):
+        
+        oppColour   = chess.invColour(chess.getColour(move.piece))
+        toIndex     = chess.coordsToIndex(move.toPos)
+        
+        if (gs.getBits(oppColour | chess.ALL) | gs.getEnPassant(oppColour)) & (0b1 << toIndex):
+            return
+        
+        if ply < self.maxPly:
+            killers = self.killers[ply]
+            if move != killers[0]:
+                killers[1] = killers[0]
+                killers[0] = move
+                
+        self.history[move.piece][toIndex] += depth * depth
+        
+
+class SearchTimeout(Exception):
+    pass
+
+class SearchResult():
+
+    def __init__(self, bestMove, score, depth, nodes, seconds):
+        self.bestMove   = bestMove
+        self.score      = score
+        self.depth      = depth
+        self.nodes      = nodes
+        self.seconds    = seconds
+
+    def getBestMove(self):
+        return self.bestMove
+
+    def getScore(self):
+        return self.score
+
+    def getDepth(self):
+        return self.depth
+
+    def getNodes(self):
+        return self.nodes
+
+    def getTimeMs(self):
+        return 1000 * self.seconds
+
+    # Nodes per second
+    def getNps(self):
+        if self.seconds == 0:
+            return 0
+        return int(self.nodes / self.seconds)
+
+    def __str__(self):
+        return "depth {} score {} nodes {} nps {} time {}ms move {}".format(
+            self.depth, self.score, self.nodes, self.getNps(), int(self.getTimeMs()), self.bestMove)
+
+
+# Iterative deepening negamax with alpha-beta pruning. The transposition
+# table is kept between searches, so a Searcher can be reused move to move.
+# With a chesstablebase.Tablebase, nodes it covers are scored from it exactly.
+# With a chessbook.OpeningBook, positions in it are played from it unsearched
+class Searcher():
+
+    def __init__(self, table=None, tableSizeMB=16, tablebase=None, book=None, quiescence=True):
+
+        if table is None:
+            table = chesstable.TranspositionTable(tableSizeMB)
+
+        self.table          = table
+        self.tablebase      = tablebase
+        self.book           = book
+        self.quiescence     = quiescence
+        self.orderer        = MoveOrderer()
+        self.nodes          = 0
+        self.quiesceNodes   = 0
+        self.quiesceBudget  = 0
+        self.tablebaseHits  = 0
+        self.deadline       = None
+
+    # Searches gs to maxDepth plies, or until timeMs has passed.
+    # With neither given, searches to DEFAULTDEPTH
+    def search(self, gs, maxDepth=None, timeMs=None):
+
+        if maxDepth is None:
+            maxDepth = DEFAULTDEPTH if timeMs is None else MAXDEPTH
+
+        startTime       = time.perf_counter()
+        self.deadline   = None if timeMs is None else startTime + timeMs / 1000
+        self.nodes          = 0
+        self.quiesceNodes   = 0
+        self.tablebaseHits  = 0
+
+        if self.book is not None:
+            bookMove = self.book.getMove(gs)
+            if bookMove is not None:
+                return SearchResult(bookMove, 0, 0, 0, time.perf_counter() - startTime)
+
+        rootMoves = gs.getLegalMoveList(gs.getTurnPlayer())
+
+        # No search is needed with one or no choice of move
+        if len(rootMoves) <= 1:
+            bestMove = rootMoves[0] if rootMoves else None
+            return SearchResult(bestMove, WIN if not rootMoves else 0, 0, 0, time.perf_counter() - startTime)
+
+        self.orderer.age()
+        rootMoves   = self.orderer.orderMoves(gs, rootMoves, 0, self.table.getMove(gs.getHash()))
+        
+        bestMove    = rootMoves[0]
+        bestScore   = -INFINITY
+        depth       = 0
+
+        for iterDepth in range(1, maxDepth + 1):
+            try:
+                iterMove, iterScore = self.searchRoot(gs, rootMoves, iterDepth)
+            except SearchTimeout as timeout:
+                # Moves are searched previous best first, so a better move
+                # found before time ran out is still safe to play
+                iterMove, iterScore = timeout.args
+                if iterMove is not None:
+                    bestMove, bestScore = iterMove, iterScore
+                break
+
+            bestMove, bestScore, depth = iterMove, iterScore, iterDepth
+
+            # Search the best move first in the next iteration
+            rootMoves.remove(bestMove)
+            rootMoves.insert(0, bestMove)
+
+            if isWinScore(bestScore):
+                break
+
+        return SearchResult(bestMove, bestScore, depth, self.nodes, time.perf_counter() - startTime)
+
+    # Makes a running search return its best move so far as soon as it next
+    # checks the clock. Safe to call from another thread
+    def stop(self):
+        self.deadline = 0
+
+    def searchRoot(self, gs, rootMoves, depth):
+
+        alpha       = -INFINITY
+        beta        = INFINITY
+        bestMove    = None
+
+        for move in rootMoves:
+            gs.makeMove(move)
+            try:
+                score = -self.negamax(gs, depth - 1, -beta, -alpha, 1)
+            except SearchTimeout:
+                gs.unmakeMove()
+                raise SearchTimeout(bestMove, alpha)
+            gs.unmakeMove()
+
+            if score > alpha:
+                alpha       = score
+                bestMove    = move
+
+        self.table.store(gs.getHash(), depth, chesstable.EXACT, alpha, chess.moveToCode(bestMove))
+
+        return bestMove, alpha
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % TIMECHECKNODES == 0:
+            if time.perf_counter() > self.deadline:
+                raise SearchTimeout(None, -INFINITY)
+
+        key         = gs.getHash()
+        entry       = self.table.probe(key)
+        hashMove    = None
+
+        if entry is not None:
+            _, entryDepth, bound, entryScore, hashMove = entry
+
+            if entryDepth >= depth:
+                entryScore = scoreFromTable(entryScore, ply)
+
+                if bound == chesstable.EXACT:
+                    return entryScore
+                if bound == chesstable.LOWER and entryScore >= beta:
+                    return entryScore
+                if bound == chesstable.UPPER and entryScore <= alpha:
+                    return entryScore
+
+        if self.tablebase is not None and \
+                countBits(gs.getBits(chess.BOTH | chess.ALL)) <= self.tablebase.maxPieces:
+            code = self.tablebase.probeCode(gs)
+            if code is not None:
+                self.tablebaseHits += 1
+                return tablebaseScore(code, ply)
+
+        # In antichess, a side with no pieces or no legal moves has won
+        moves = gs.getLegalMoveList(gs.getTurnPlayer())
+        if len(moves) == 0:
+            return WIN - ply
+
+        if depth <= 0:
+            if not self.quiescence:
+                return evaluate(gs)
+            
+            # The moves are all captures when any is, so the first tells
+            self.quiesceBudget = MAXQUIESCENODES
+            captures = moves if isCaptureMove(gs, moves[0]) else []
+            return self.quiesce(gs, alpha, beta, ply, 0, captures)
+
+        moves = self.orderer.orderMoves(gs, moves, ply, hashMove)
+
+        alphaOrig   = alpha
+        bestScore   = -INFINITY
+        bestMove    = None
+
+        for move in moves:
+            gs.makeMove(move)
+            try:
+                score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                gs.unmakeMove()
+
+            if score > bestScore:
+                bestScore   = score
+                bestMove    = move
+
+            if score > alpha:
+                alpha = score
+
+            if alpha >= beta:
+                self.orderer.recordCutoff(gs, move, ply, depth)
+                break
+
+        if bestScore <= alphaOrig:
+            bound = chesstable.UPPER
+        elif bestScore >= beta:
+            bound = chesstable.LOWER
+        else:
+            bound = chesstable.EXACT
+
+        bestCode = None if bestMove is None else chess.moveToCode(bestMove)
+        self.table.store(key, depth, bound, scoreToTable(bestScore, ply), bestCode)
+
+        return bestScore
+
+
+    # Searches only forced captures, so a leaf in the middle of a capture
+    # chain is not scored until the chain ends. A side that is not forced to
+    # capture stands pat on the static score, as it is free to choose its
+    # move; a side that is forced must play on. captures are the side to
+    # move's captures, if already generated
+    def quiesce(self, gs, alpha, beta, ply, qply, captures=None):
+
+        if captures is None:
+            self.nodes          += 1
+            self.quiesceNodes   += 1
+            self.quiesceBudget  -= 1
+            if self.deadline is not None and self.nodes % TIMECHECKNODES == 0:
+                if time.perf_counter() > self.deadline:
+                    raise SearchTimeout(None, -INFINITY)
+
+            captures = forceCapture(gs)
+
+        if len(captures) == 0:
+            # In antichess, a side with no pieces or no legal moves has won
+            colour = gs.getTurnPlayer()
+            if gs.getBits(colour | chess.ALL) == 0 or not any(True for move in gs.generateLegalMoves(colour)):
+                return WIN - ply
+            return evaluate(gs)
+
+        if qply >= MAXQUIESCEDEPTH or self.quiesceBudget <= 0:
+            return evaluate(gs)
+
+        bestScore = -INFINITY
+        for move in self.orderer.orderMoves(gs, captures, ply):
+            gs.makeMove(move)
+            try:
+                score = -self.quiesce(gs, -beta, -alpha, ply + 1, qply + 1)
+            finally:
+                gs.unmakeMove()
+
+            if score > bestScore:
+                bestScore = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        return bestScore
+
+
+# True if move, legal in gs, captures a piece
+def isCaptureMove(gs, move):
+    oppColour   = chess.invColour(chess.getColour(move.piece))
+    toBit       = 0b1 << chess.coordsToIndex(move.toPos)
+    targets     = gs.getBits(oppColour | chess.ALL)
+
+    if chess.getPieceType(move.piece) == chess.PAWN:
+        targets |= gs.getEnPassant(oppColour)
+
+    return targets & toBit != 0
+
+# Searches gs and returns a SearchResult, including nodes searched and nodes
+# per second
+def search(gs, maxDepth=None, timeMs=None, table=None, tablebase=None, book=None):
+    return Searcher(table, tablebase=tablebase, book=book).search(gs, maxDepth, timeMs)
+
+def getSearchMove(gs, maxDepth=None, timeMs=None):
+    return search(gs, maxDepth, timeMs).getBestMove()
@@ -0,0 +1,248 @@
+import chessmasks as cm
+
+
+# Static evaluation for antichess. Every piece is a liability, since the aim
+# is to lose them all, so material counts against the side holding it.
+# Scores are from the side to move's view, in centipawns.
+#
+# Material and piece-square terms are summed in gamestates as they change:
+# chess.GamestateBase keeps evalScore, the sum of signedScores over every
+# piece (white's positive, black's negative), up to date in makeMove,
+# unmakeMove, promotePiece and __setitem__, so evaluate never rescans the
+# boards for them. Like chessmasks, this module takes no chess import, so
+# chess can import it.
+
+NONE    = cm.NONE
+PAWN    = cm.PAWN
+QUEEN   = cm.QUEEN
+KING    = cm.KING
+ROOK    = cm.ROOK
+BISHOP  = cm.BISHOP
+KNIGHT  = cm.KNIGHT
+ALL     = cm.ALL
+
+WHITE   = cm.WHITE
+BLACK   = cm.BLACK
+BOTH    = WHITE | BLACK
+
+# Cost of owning each piece. Pieces that struggle to give themselves away
+# cost most
+material = {PAWN: 100, KNIGHT: 160, BISHOP: 200, ROOK: 240, QUEEN: 180, KING: 140}
+
+# Bonus for each piece on each square, for white, written as seen from
+# white's side (the first row is rank 8). Central and forward pieces reach
+# the opponent's pieces sooner, and so give themselves away sooner
+pieceSquareTables = {
+    PAWN: [
+          0,   0,   0,   0,   0,   0,   0,   0,
+         40,  40,  40,  40,  40,  40,  40,  40,
+         20,  20,  25,  30,  30,  25,  20,  20,
+         10,  10,  15,  20,  20,  15,  10,  10,
+          5,   5,  10,  15,  15,  10,   5,   5,
+          0,   0,   5,   5,   5,   5,   0,   0,
+          0,   0,   0,  -5,  -5,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0],
+    KNIGHT: [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10,   0,   5,   5,   5,   5,   0, -10,
+        -10,   5,  10,  15,  15,  10,   5, -10,
+        -10,   5,  15,  20,  20,  15,   5, -10,
+        -10,   5,  15,  20,  20,  15,   5, -10,
+        -10,   5,  10,  15,  15,  10,   5, -10,
+        -10,   0,   5,   5,   5,   5,   0, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20],
+    BISHOP: [
+        -10,  -5,  -5,  -5,  -5,  -5,  -5, -10,
+         -5,   5,   0,   0,   0,   0,   5,  -5,
+         -5,   0,  10,  10,  10,  10,   0,  -5,
+         -5,   0,  10,  15,  15,  10,   0,  -5,
+         -5,   0,  10,  15,  15,  10,   0,  -5,
+         -5,   0,  10,  10,  10,  10,   0,  -5,
+         -5,   5,   0,   0,   0,   0,   5,  -5,
+        -10,  -5,  -5,  -5,  -5,  -5,  -5, -10],
+    ROOK: [
+          5,   5,   5,   5,   5,   5,   5,   5,
+         10,  10,  10,  10,  10,  10,  10,  10,
+          0,   0,   5,   5,   5,   5,   0,   0,
+          0,   0,   5,   5,   5,   5,   0,   0,
+          0,   0,   5,   5,   5,   5,   0,   0,
+          0,   0,   5,   5,   5,   5,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,
+         -5,   0,   0,   0,   0,   0,   0,  -5],
+    QUEEN: [
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+          0,   5,   5,   5,   5,   5,   5,   0,
+          0,   5,  10,  10,  10,  10,   5,   0,
+          0,   5,  10,  15,  15,  10,   5,   0,
+          0,   5,  10,  15,  15,  10,   5,   0,
+          0,   5,  10,  10,  10,  10,   5,   0,
+          0,   5,   5,   5,   5,   5,   5,   0,
+         -5,   0,   0,   0,   0,   0,   0,  -5],
+    KING: [
+        -10,  -5,  -5,  -5,  -5,  -5,  -5, -10,
+         -5,   5,   5,   5,   5,   5,   5,  -5,
+         -5,   5,  10,  10,  10,  10,   5,  -5,
+         -5,   5,  10,  15,  15,  10,   5,  -5,
+         -5,   5,  10,  15,  15,  10,   5,  -5,
+         -5,   5,  10,  10,  10,  10,   5,  -5,
+         -5,   5,   5,   5,   5,   5,   5,  -5,
+        -10,  -5,  -5,  -5,  -5,  -5,  -5, -10],
+}
+
+# Mobility is counted as squares attacked that are not the side's own
+MOBILITYWEIGHT  = 4
+
+# A side to move that must capture takes on material, while pieces left
+# for the opponent to capture are material about to be lost
+FORCEDCAPTURE   = 60
+CAPTUREOFFERED  = 40
+
+# Value of a piece code on a board index, to its owner
+def getPieceSquareValue(piece, index):
+    pieceType   = piece & ALL
+    x, y        = 7 - index % 8, index // 8
+
+    # Tables are written as seen by white, so black reads them upside down
+    row = y if piece & 0b11 == WHITE else 7 - y
+
+    return pieceSquareTables[pieceType][8*row + x] - material[pieceType]
+
+# signedScores[piece][index]: the value of piece on index, positive for a
+# white piece and negative for a black one. Indexed by piece code like
+# chess.zobristPieces
+signedScores = [[0] * 64 for piece in range(0, (BOTH | ALL) + 1)]
+for pieceType in cm.pieceArray:
+    for colour in cm.colourArray:
+        sign = 1 if colour == WHITE else -1
+        signedScores[pieceType | colour] = [sign * getPieceSquareValue(pieceType | colour, index)
+                                            for index in range(0, 64)]
+
+# Computes the incremental term from scratch, to set it after the boards
+# are set or to check the running one
+def computeEvalScore(gs):
+    score = 0
+    for pieceType in cm.pieceArray:
+        for colour in cm.colourArray:
+            piece   = pieceType | colour
+            scores  = signedScores[piece]
+            bits    = gs.getBits(piece)
+            while bits:
+                lowBit  = bits & -bits
+                bits    ^= lowBit
+                score   += scores[lowBit.bit_length() - 1]
+
+    return score
+
+def countBits(bits):
+    return bin(bits).count("1")
+
+def invColour(colour):
+    return colour ^ BOTH
+
+# Squares colour's pieces attack, pawns diagonally
+def getAttackSet(gs, colour, occupancy):
+
+    attacks = cm.getPawnAttacks(colour, gs.getBits(PAWN | colour))
+
+    for pieceType, table in [(KNIGHT, cm.knightAttackTable), (KING, cm.kingAttackTable)]:
+        bits = gs.getBits(pieceType | colour)
+        while bits:
+            lowBit  = bits & -bits
+            bits    ^= lowBit
+            attacks |= table[lowBit.bit_length() - 1]
+
+    for pieceType in [QUEEN, ROOK, BISHOP]:
+        slidingAttacks = cm.slidingAttackDict[pieceType]
+        bits = gs.getBits(pieceType | colour)
+        while bits:
+            lowBit  = bits & -bits
+            bits    ^= lowBit
+            attacks |= slidingAttacks(lowBit.bit_length() - 1, occupancy)
+
+    return attacks
+
+def evaluate(gs):
+
+    colour      = gs.getTurnPlayer()
+    oppColour   = invColour(colour)
+    occupancy   = gs.getBits(BOTH | ALL)
+    ownBits     = gs.getBits(colour | ALL)
+    oppBits     = gs.getBits(oppColour | ALL)
+
+    score = gs.evalScore if colour == WHITE else -gs.evalScore
+
+    ownAttacks  = getAttackSet(gs, colour, occupancy)
+    oppAttacks  = getAttackSet(gs, oppColour, occupancy)
+
+    score += MOBILITYWEIGHT * (countBits(ownAttacks & ~ownBits) - countBits(oppAttacks & ~oppBits))
+
+    # Pawn attacks also take en passant, which the attack sets include only
+    # as a square, so the pawns are checked for it apart
+    ownPawnAttacks = cm.getPawnAttacks(colour, gs.getBits(PAWN | colour))
+    if ownAttacks & oppBits or ownPawnAttacks & gs.getEnPassant(oppColour):
+        score -= FORCEDCAPTURE
+    if oppAttacks & ownBits:
+        score += CAPTUREOFFERED
+
+    return score
+
+
+# BATCH
+# evaluateMany scores many positions at once with numpy, through
+# chessbatch.PositionBatch, giving the same scores as evaluate. numpy is only
+# imported here, so evaluate works without it
+
+# Popcount of each uint64 in an array (SWAR)
+def batchCountBits(np, bits):
+    bits = bits - ((bits >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    bits = (bits & np.uint64(0x3333333333333333)) + ((bits >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    bits = (bits + (bits >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((bits * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+# For each piece, its squares grouped by signed score: [(score, mask)]
+def scoreMasks(piece):
+    masks = dict()
+    for index in range(0, 64):
+        score = signedScores[piece][index]
+        masks[score] = masks.get(score, 0) | (0b1 << index)
+    return list(masks.items())
+
+# positions is a chessbatch.PositionBatch, or gamestates to make one from.
+# Returns a numpy array of scores, each from its own side to move's view
+def evaluateMany(positions):
+
+    import numpy as np
+    import chessbatch as cb
+
+    batch = positions if isinstance(positions, cb.PositionBatch) else cb.PositionBatch.fromGamestates(positions)
+
+    whiteScore = np.zeros(len(batch), dtype=np.int64)
+    for piece in cb.batchPieces:
+        bits = batch.getBits(piece)
+        for score, mask in scoreMasks(piece):
+            whiteScore += score * batchCountBits(np, bits & np.uint64(mask))
+
+    terms = dict()
+    for colour in cm.colourArray:
+        oppColour   = invColour(colour)
+        ownBits     = batch.getAll(colour)
+        oppBits     = batch.getAll(oppColour)
+        pawnAttacks = cb.pawnAttacks(colour, batch.getBits(PAWN | colour))
+        attacks     = batch.pieceAttacks(colour) | pawnAttacks
+
+        sideScore   = whiteScore if colour == WHITE else -whiteScore
+        mobility    = batchCountBits(np, attacks & ~ownBits)
+        mustCapture = ((attacks & oppBits) | (pawnAttacks & batch.getEnPassant(oppColour))) != 0
+        offered     = (attacks & oppBits) != 0
+
+        terms[colour] = (sideScore, mobility, mustCapture, offered)
+
+    scores = dict()
+    for colour in cm.colourArray:
+        sideScore, mobility, mustCapture, _ = terms[colour]
+        _, oppMobility, _, oppOffered       = terms[invColour(colour)]
+
+        scores[colour] = sideScore + MOBILITYWEIGHT * (mobility - oppMobility) \
+            - FORCEDCAPTURE * mustCapture + CAPTUREOFFERED * oppOffered
+
+    return np.where(batch.turns == WHITE, scores[WHITE], scores[BLACK])
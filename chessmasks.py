@@ -71,7 +71,7 @@ for x in range(0,8):
         baseKing        = 0b1_11000000
         kingMaskTemp    = ((baseKing >> x) & 0b11111111)  << y*8
         
-        kingMask[x,y]   =  kingMaskTemp | (kingMaskTemp << 8) | (kingMaskTemp >> 8)
+        kingMask[x,y]   =  (kingMaskTemp | (kingMaskTemp << 8) | (kingMaskTemp >> 8)) & ((0b1 << 64) - 1)
         
         #PAWN
         basePawn        = 0b1_01000000
@@ -91,7 +91,7 @@ for x in range(0,8):
         baseKnight2     = 0b01_01000000
         knightMaskTemp2 = ((baseKnight2 >> x) & 0b11111111) << y*8
         
-        knightMask[x,y] = (knightMaskTemp1 << 8 | knightMaskTemp1 >> 8) | (knightMaskTemp2 >> 16 | knightMaskTemp2 << 16)
+        knightMask[x,y] = ((knightMaskTemp1 << 8 | knightMaskTemp1 >> 8) | (knightMaskTemp2 >> 16 | knightMaskTemp2 << 16)) & ((0b1 << 64) - 1)
         
         
 maskDict = dict()
@@ -152,4 +152,122 @@ def getDoubleStepPawnMask(colour, pos):
 doublePawnRow = {BLACK: 1, WHITE: 6}
 
 def canDoubleStepPawn(colour, pos):
-    return doublePawnRow[colour] == pos[1]
\ No newline at end of file
+    return doublePawnRow[colour] == pos[1]
+
+# SLIDING ATTACK TABLES
+# For each square, every subset of the blocker squares on its lines is
+# precomputed once, so a sliding lookup is one AND and one dict index:
+#   rookAttackTable[index][occupancy & rookRelevantMask[index]]
+# The edge square of each ray is left out of the relevant mask, since a
+# piece there never changes which squares are attacked.
+
+# Board index of (x,y), matching chess.coordsToIndex
+def squareIndex(x, y):
+    return 8*y + (7-x)
+
+rookDirections      = [(1,0), (-1,0), (0,1), (0,-1)]
+bishopDirections    = [(1,1), (1,-1), (-1,1), (-1,-1)]
+
+def buildSlidingTables(directions):
+    relevantMasks   = [0b0] * 64
+    attackTables    = [None] * 64
+    
+    for x in range(0,8):
+        for y in range(0,8):
+            rays    = []
+            mask    = 0b0
+            
+            for dx, dy in directions:
+                ray = []
+                cx, cy = x + dx, y + dy
+                while 0 <= cx <= 7 and 0 <= cy <= 7:
+                    ray.append(0b1 << squareIndex(cx, cy))
+                    cx, cy = cx + dx, cy + dy
+                    
+                rays.append(ray)
+                for bit in ray[:-1]:
+                    mask |= bit
+                
+            # Walk every subset of mask (Carry-Rippler), starting from empty
+            table   = dict()
+            blockers = 0b0
+            while True:
+                attacks = 0b0
+                for ray in rays:
+                    for bit in ray:
+                        attacks |= bit
+                        if blockers & bit:
+                            break
+                        
+                table[blockers] = attacks
+                blockers = (blockers - mask) & mask
+                if blockers == 0:
+                    break
+                
+            index = squareIndex(x, y)
+            relevantMasks[index]    = mask
+            attackTables[index]     = table
+            
+    return relevantMasks, attackTables
+
+rookRelevantMask,   rookAttackTable     = buildSlidingTables(rookDirections)
+bishopRelevantMask, bishopAttackTable   = buildSlidingTables(bishopDirections)
+
+# Returns attacked squares (own pieces included) for a rook on index, given
+# occupancy of the whole board
+def getRookAttacks(index, occupancy):
+    return rookAttackTable[index][occupancy & rookRelevantMask[index]]
+
+def getBishopAttacks(index, occupancy):
+    return bishopAttackTable[index][occupancy & bishopRelevantMask[index]]
+
+def getQueenAttacks(index, occupancy):
+    return rookAttackTable[index][occupancy & rookRelevantMask[index]] |\
+        bishopAttackTable[index][occupancy & bishopRelevantMask[index]]
+
+slidingAttackDict = {ROOK: getRookAttacks, BISHOP: getBishopAttacks, QUEEN: getQueenAttacks}
+
+def getSlidingAttacks(piece, index, occupancy):
+    return slidingAttackDict[piece & ~0b11](index, occupancy)
+
+
+# ATTACKS BY SQUARE INDEX
+# The (x,y) keyed masks above, re-keyed by board index for the bit-scan loops
+knightAttackTable   = [0b0] * 64
+kingAttackTable     = [0b0] * 64
+pawnAttackTable     = {WHITE: [0b0] * 64, BLACK: [0b0] * 64}
+
+for x in range(0,8):
+    for y in range(0,8):
+        index = squareIndex(x, y)
+        knightAttackTable[index]        = knightMask[x,y]
+        kingAttackTable[index]          = kingMask[x,y]
+        pawnAttackTable[WHITE][index]   = pawnMaskWhite[x,y]
+        pawnAttackTable[BLACK][index]   = pawnMaskBlack[x,y]
+
+# Squares attacked by a piece on index (own pieces included). Pawns attack
+# their two diagonal capture squares
+def getAttacks(piece, index, occupancy):
+    pieceType = piece & ~0b11
+    
+    if pieceType == PAWN:
+        return pawnAttackTable[piece & 0b11][index]
+    elif pieceType == KNIGHT:
+        return knightAttackTable[index]
+    elif pieceType == KING:
+        return kingAttackTable[index]
+    else:
+        return slidingAttackDict[pieceType](index, occupancy)
+
+# Board index is 8*y + (7-x), so column x=0 is the top bit of each byte
+colMaskLeft     = vertMask[0]
+colMaskRight    = vertMask[7]
+fullMask        = (0b1 << 64) - 1
+
+# Squares attacked by all pawns in pawnBits at once. White pawns move up
+# the board (index - 8), black pawns down (index + 8)
+def getPawnAttacks(colour, pawnBits):
+    if colour == WHITE:
+        return ((pawnBits & ~colMaskLeft) >> 7) | ((pawnBits & ~colMaskRight) >> 9)
+    else:
+        return (((pawnBits & ~colMaskLeft) << 9) | ((pawnBits & ~colMaskRight) << 7)) & fullMask
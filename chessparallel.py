@@ -0,0 +1,194 @@
+import chess
+import chessbot
+import chessperft
+import concurrent.futures
+import os
+import sys
+import time
+
+
+# Root-splitting parallel search. Each iteration of iterative deepening
+# searches the best root move so far first, in one worker, to get a bound;
+# the other root moves are then searched against that bound one per task
+# across a pool of worker processes, so idle workers take the next move.
+# Positions and moves travel as FEN and coordinate strings.
+
+# Each worker process keeps one Searcher, and so one transposition table,
+# for every task it runs
+workerSearcher = None
+
+def initWorker(tableSizeMB):
+    global workerSearcher
+    workerSearcher = chessbot.Searcher(tableSizeMB=tableSizeMB)
+
+# Searches each move of moveTexts from the position fen to depth, against the
+# lower bound alpha. Returns ([(moveText, score)], nodes), stopping early with
+# a score of None if the deadline (from time.time) passes. Scores of moves
+# no better than alpha are only upper bounds
+def searchMoves(fen, moveTexts, depth, alpha, deadline):
+
+    gs          = chess.CompactGamestate.fromFEN(fen)
+    searcher    = workerSearcher
+
+    searcher.nodes      = 0
+    searcher.deadline   = None if deadline is None else time.perf_counter() + (deadline - time.time())
+
+    results = []
+    for text in moveTexts:
+        # negamax only checks the clock every chessbot.TIMECHECKNODES nodes,
+        # so tasks started after the deadline would still search that many
+        if deadline is not None and time.time() > deadline:
+            results.append((text, None))
+            break
+
+        gs.makeMove(chess.coordStringToMove(gs, text))
+        try:
+            score = -searcher.negamax(gs, depth - 1, -chessbot.INFINITY, -alpha, 1)
+        except chessbot.SearchTimeout:
+            results.append((text, None))
+            break
+        finally:
+            gs.unmakeMove()
+
+        results.append((text, score))
+
+    return results, searcher.nodes
+
+
+class ParallelSearcher():
+
+    def __init__(self, workers=None, tableSizeMB=16):
+
+        self.workers    = workers if workers is not None else os.cpu_count()
+        self.pool       = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=initWorker, initargs=(tableSizeMB,))
+        self.orderer    = chessbot.MoveOrderer()
+
+    # Searches gs like chessbot.Searcher.search, returning a SearchResult
+    # whose nodes are the total over all workers
+    def search(self, gs, maxDepth=None, timeMs=None):
+
+        if maxDepth is None:
+            maxDepth = chessbot.DEFAULTDEPTH if timeMs is None else chessbot.MAXDEPTH
+
+        startTime   = time.perf_counter()
+        deadline    = None if timeMs is None else time.time() + timeMs / 1000
+
+        rootMoves = gs.getLegalMoveList(gs.getTurnPlayer())
+
+        # No search is needed with one or no choice of move
+        if len(rootMoves) <= 1:
+            bestMove = rootMoves[0] if rootMoves else None
+            return chessbot.SearchResult(bestMove, chessbot.WIN if not rootMoves else 0, 0, 0,
+                                         time.perf_counter() - startTime)
+
+        fen         = gs.toFEN()
+        moveTexts   = [chess.moveToCoordString(move) for move in self.orderer.orderMoves(gs, rootMoves, 0)]
+        moves       = {chess.moveToCoordString(move): move for move in rootMoves}
+
+        bestText    = moveTexts[0]
+        bestScore   = -chessbot.INFINITY
+        depth       = 0
+        nodes       = 0
+
+        for iterDepth in range(1, maxDepth + 1):
+
+            # The best move so far alone sets the bound for the rest
+            results, firstNodes = self.pool.submit(searchMoves, fen, moveTexts[:1], iterDepth,
+                                                   -chessbot.INFINITY, deadline).result()
+            nodes += firstNodes
+            alpha = results[0][1]
+            if alpha is None:
+                break
+
+            futures = [self.pool.submit(searchMoves, fen, [text], iterDepth, alpha, deadline)
+                       for text in moveTexts[1:]]
+
+            scores      = {moveTexts[0]: alpha}
+            timedOut    = False
+            for future in futures:
+                if future.cancelled():
+                    continue
+
+                results, taskNodes = future.result()
+                nodes += taskNodes
+                for text, score in results:
+                    if score is None:
+                        timedOut = True
+                    else:
+                        scores[text] = score
+
+                # Tasks not yet started would only time out too
+                if timedOut:
+                    for pending in futures:
+                        pending.cancel()
+
+            iterText = max(scores, key=lambda text: scores[text])
+
+            # Scores of moves searched before time ran out are still exact
+            # where they beat the first move's, as in chessbot.Searcher
+            if timedOut:
+                if scores[iterText] > alpha or depth == 0:
+                    bestText, bestScore = iterText, scores[iterText]
+                break
+
+            bestText, bestScore, depth = iterText, scores[iterText], iterDepth
+
+            # Search the best move first in the next iteration
+            moveTexts.remove(bestText)
+            moveTexts.insert(0, bestText)
+
+            if chessbot.isWinScore(bestScore):
+                break
+
+        return chessbot.SearchResult(moves[bestText], bestScore, depth, nodes, time.perf_counter() - startTime)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Searches each FEN to maxDepth single-threaded and with each worker count,
+# printing the time taken and the speedup over single-threaded.
+# Pools are started before timing, so only searching is measured
+def benchmark(fens, maxDepth=4, workerCounts=None):
+
+    if workerCounts is None:
+        workerCounts = [os.cpu_count()]
+
+    startTime = time.perf_counter()
+    searcher = chessbot.Searcher()
+    nodes = 0
+    for fen in fens:
+        nodes += searcher.search(chess.CompactGamestate.fromFEN(fen), maxDepth).getNodes()
+    baseTime = time.perf_counter() - startTime
+    print("{:>7} workers time {:8.3f}s nodes {:>9} speedup {:5.2f}".format("single", baseTime, nodes, 1))
+
+    for workers in workerCounts:
+        with ParallelSearcher(workers) as parallel:
+            list(parallel.pool.map(time.sleep, [0] * workers))
+
+            startTime = time.perf_counter()
+            nodes = 0
+            for fen in fens:
+                nodes += parallel.search(chess.CompactGamestate.fromFEN(fen), maxDepth).getNodes()
+            seconds = time.perf_counter() - startTime
+
+        print("{:>7} workers time {:8.3f}s nodes {:>9} speedup {:5.2f}".format(
+            workers, seconds, nodes, baseTime / seconds))
+
+
+# python chessparallel.py [maxDepth] [workers ...]
+# Benchmarks on the perft positions
+if __name__ == "__main__":
+
+    args            = sys.argv[1:]
+    maxDepth        = int(args[0]) if len(args) > 0 else 4
+    workerCounts    = [int(arg) for arg in args[1:]] or None
+
+    benchmark([fen for name, fen, counts in chessperft.perftPositions], maxDepth, workerCounts)
@@ -0,0 +1,132 @@
+import chess
+import sys
+import time
+
+
+# Positions with known-good perft node counts, by depth from 1. Counts were
+# checked against an independent antichess move generator (python-chess
+# AntichessBoard)
+perftPositions = [
+    ("start",
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1",
+        [20, 400, 8067, 153299, 2732672]),
+    ("middlegame1",
+        "rnbqkbn1/p3ppp1/1ppp4/8/PP3P2/N7/2PPP2R/1RBQKBN1 b - f3 0 1",
+        [25, 530, 7492]),
+    ("middlegame2",
+        "rnbqk1n1/1ppp2p1/p3p3/5p1r/P1P4p/R6N/1P1PPPPP/2BQKB1R w - f6 0 1",
+        [26, 551, 6768]),
+    ("endgame1",
+        "5b2/4k3/1P1p4/8/5p2/8/8/3q4 b - - 0 1",
+        [28, 28, 685, 3400]),
+    ("endgame2",
+        "8/8/8/8/R7/P1N2p1p/7P/5K2 w - - 0 1",
+        [23, 23, 63, 205]),
+    ("endgame3",
+        "8/8/2b2p1p/8/7P/8/5P1B/5K2 w - - 0 1",
+        [14, 145, 1628, 14332]),
+    ("endgame4",
+        "5k2/8/8/1p6/1P3Pb1/8/5P2/4K3 w - - 0 1",
+        [6, 32, 213, 2209]),
+]
+
+
+# Counts the leaf nodes of the legal move tree to depth plies
+def perft(gs, depth):
+    
+    moves = gs.getLegalMoveList(gs.getTurnPlayer())
+    
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.unmakeMove()
+        
+    return nodes
+
+# Perft split by root move. Returns a dict of move string to node count,
+# for comparing against another generator to find where they differ
+def divide(gs, depth):
+    
+    counts = dict()
+    for move in gs.getLegalMoveList(gs.getTurnPlayer()):
+        gs.makeMove(move)
+        counts[chess.moveToCoordString(move)] = perft(gs, depth - 1)
+        gs.unmakeMove()
+        
+    return counts
+
+# Plays a space separated list of moves from the start position
+def positionFromMoves(moves, gamestateClass=chess.Gamestate):
+    
+    gs = gamestateClass()
+    gs.default()
+    
+    for text in moves.split():
+        gs.makeMove(chess.coordStringToMove(gs, text))
+        
+    return gs
+
+# Runs perft on every stored position up to maxDepth, printing nodes per
+# second. Returns False if any count differs from the stored one
+def benchmark(maxDepth=3, gamestateClass=chess.Gamestate):
+    
+    allCorrect  = True
+    totalNodes  = 0
+    totalTime   = 0
+    
+    for name, fen, counts in perftPositions:
+        gs = gamestateClass.fromFEN(fen)
+        
+        for depth in range(1, min(maxDepth, len(counts)) + 1):
+            startTime   = time.perf_counter()
+            nodes       = perft(gs, depth)
+            seconds     = time.perf_counter() - startTime
+            
+            totalNodes  += nodes
+            totalTime   += seconds
+            
+            correct     = nodes == counts[depth - 1]
+            allCorrect  = allCorrect and correct
+            
+            print("{:<12} depth {} nodes {:>9} time {:8.3f}s nps {:>8} {}".format(
+                name, depth, nodes, seconds, int(nodes / seconds) if seconds else 0,
+                "ok" if correct else "FAIL (expected {})".format(counts[depth - 1])))
+            
+    print("total nodes {} time {:.3f}s nps {}".format(
+        totalNodes, totalTime, int(totalNodes / totalTime) if totalTime else 0))
+    
+    return allCorrect
+
+
+# python chessperft.py [maxDepth] [--compact]
+# python chessperft.py --divide depth [moves... | FEN]
+if __name__ == "__main__":
+    
+    args = sys.argv[1:]
+    gamestateClass = chess.Gamestate
+    
+    if "--compact" in args:
+        args.remove("--compact")
+        gamestateClass = chess.CompactGamestate
+    
+    if len(args) > 0 and args[0] == "--divide":
+        position = " ".join(args[2:])
+        if "/" in position:
+            gs = gamestateClass.fromFEN(position)
+        else:
+            gs = positionFromMoves(position, gamestateClass)
+        counts  = divide(gs, int(args[1]))
+        
+        for text in sorted(counts):
+            print(text, counts[text])
+        print("total", sum(counts.values()))
+        
+    else:
+        maxDepth = int(args[0]) if len(args) > 0 else 3
+        
+        if not benchmark(maxDepth, gamestateClass):
+            sys.exit(1)
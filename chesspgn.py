@@ -0,0 +1,262 @@
+import chess
+import re
+import struct
+
+
+# Game records. Games are read and written one at a time, so corpora never
+# need to fit in memory. In both formats a game is (headers, moves, result):
+#   headers     dict of PGN tags (the binary format keeps none)
+#   moves       list of moves as written by chess.moveToCoordString, e.g. "e2e4"
+#   result      "1-0", "0-1", "1/2-1/2" or "*"
+
+RESULTS = ["1-0", "0-1", "1/2-1/2", "*"]
+
+letterToPiece = {"Q": chess.QUEEN, "R": chess.ROOK, "K": chess.KING, "N": chess.KNIGHT, "B": chess.BISHOP}
+
+
+# SAN
+
+def isCapture(gs, move):
+    oppColour   = chess.invColour(chess.getColour(move.getPiece()))
+    toBit       = 0b1 << chess.coordsToIndex(move.getToPos())
+    targets     = gs.getBits(oppColour | chess.ALL)
+
+    if chess.getPieceType(move.getPiece()) == chess.PAWN:
+        targets |= gs.getEnPassant(oppColour)
+
+    return targets & toBit != 0
+
+# Standard algebraic notation of move, played from gs. Antichess has no
+# check, so no "+" or "#" is added
+def moveToSan(gs, move, legalMoves=None):
+
+    piece, fromPos, toPos = move.unpack()
+    pieceType   = chess.getPieceType(piece)
+    capture     = "x" if isCapture(gs, move) else ""
+    toAlg       = chess.coordsToAlg(toPos)
+    fromAlg     = chess.coordsToAlg(fromPos)
+
+    if pieceType == chess.PAWN:
+        san = (fromAlg[0] + capture if capture else "") + toAlg
+        if move.getPromotion() != chess.NONE:
+            san += "=" + chess.pieceToLetter(move.getPromotion())
+        return san
+
+    if legalMoves is None:
+        legalMoves = gs.getLegalMoveList(gs.getTurnPlayer())
+
+    # Other pieces of the same type that could also move to toPos
+    others = [other.getFromPos() for other in legalMoves
+              if other.getPiece() == piece and other.getToPos() == toPos and other.getFromPos() != fromPos]
+
+    if len(others) == 0:
+        disambiguation = ""
+    elif all(other[0] != fromPos[0] for other in others):
+        disambiguation = fromAlg[0]
+    elif all(other[1] != fromPos[1] for other in others):
+        disambiguation = fromAlg[1]
+    else:
+        disambiguation = fromAlg
+
+    return chess.pieceToLetter(piece) + disambiguation + capture + toAlg
+
+# Returns the legal move in gs written as san
+def sanToMove(gs, san):
+
+    text = san.rstrip("+#!?").replace("=", "")
+
+    promotion = chess.NONE
+    if text[-1] in letterToPiece:
+        promotion   = letterToPiece[text[-1]]
+        text        = text[:-1]
+
+    if text[0] in letterToPiece:
+        pieceType   = letterToPiece[text[0]]
+        text        = text[1:]
+    else:
+        pieceType   = chess.PAWN
+
+    toPos           = chess.algToCoords(text[-2:])
+    disambiguation  = text[:-2].replace("x", "")
+
+    for move in gs.generateLegalMoves(gs.getTurnPlayer()):
+        if move.getToPos() != toPos or chess.getPieceType(move.getPiece()) != pieceType:
+            continue
+        if move.getPromotion() != promotion:
+            continue
+
+        fromAlg = chess.coordsToAlg(move.getFromPos())
+        if all(char in fromAlg for char in disambiguation):
+            return move
+
+    raise Exception("{} is not a legal move".format(san))
+
+
+# PGN
+
+# Writes one game as PGN text, with the Antichess variant tag
+def gameToPgn(headers, moves, result):
+
+    tags = {"Event": "?", "Site": "?", "Date": "????.??.??", "Round": "?",
+            "White": "?", "Black": "?", "Result": result}
+    tags.update(headers)
+    tags["Variant"] = "Antichess"
+
+    lines = ['[{} "{}"]'.format(key, value) for key, value in tags.items()]
+    lines.append("")
+
+    gs = chess.CompactGamestate()
+    gs.default()
+
+    tokens = []
+    for ply, text in enumerate(moves):
+        if ply % 2 == 0:
+            tokens.append("{}.".format(ply // 2 + 1))
+
+        move = chess.coordStringToMove(gs, text)
+        tokens.append(moveToSan(gs, move))
+        gs.makeMove(move)
+
+    tokens.append(result)
+
+    # Movetext lines are kept under 80 characters
+    line = ""
+    for token in tokens:
+        if len(line) + len(token) + 1 > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = token if line == "" else line + " " + token
+    lines.append(line)
+
+    return "\n".join(lines) + "\n\n"
+
+# Writes each game of games to the text file pgnFile as it arrives.
+# Returns the number of games written
+def writePgn(pgnFile, games):
+    count = 0
+    for headers, moves, result in games:
+        pgnFile.write(gameToPgn(headers, moves, result))
+        count += 1
+
+    return count
+
+tagPattern      = re.compile(r'\[(\w+)\s+"(.*)"\]')
+commentPattern  = re.compile(r"\{[^}]*\}|;[^\n]*")
+moveNumPattern  = re.compile(r"^\d+\.+")
+
+# Yields the games of the text file pgnFile one at a time
+def readPgn(pgnFile):
+
+    headers     = dict()
+    movetext    = []
+
+    for line in pgnFile:
+        line = line.strip()
+
+        if line.startswith("["):
+            # A tag after movetext starts the next game
+            if movetext:
+                yield parseGame(headers, " ".join(movetext))
+                headers, movetext = dict(), []
+
+            match = tagPattern.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+
+        elif line:
+            movetext.append(line)
+
+    if headers or movetext:
+        yield parseGame(headers, " ".join(movetext))
+
+# Turns a game's tags and movetext into (headers, moves, result)
+def parseGame(headers, movetext):
+
+    movetext    = commentPattern.sub(" ", movetext)
+    result      = headers.get("Result", "*")
+
+    gs = chess.CompactGamestate()
+    gs.default()
+
+    moves       = []
+    depth       = 0     # Nesting of ( ) variations, which are skipped
+
+    for token in movetext.replace("(", " ( ").replace(")", " ) ").split():
+        if token == "(":
+            depth += 1
+            continue
+        if token == ")":
+            depth -= 1
+            continue
+        if depth > 0 or token.startswith("$"):
+            continue
+
+        if token in RESULTS:
+            result = token
+            break
+
+        token = moveNumPattern.sub("", token)
+        if token == "":
+            continue
+
+        move = sanToMove(gs, token)
+        moves.append(chess.moveToCoordString(move))
+        gs.makeMove(move)
+
+    return headers, moves, result
+
+
+# BINARY
+# Each move is 16 bits: from index (6 bits), to index (6 bits) and promotion
+# (3 bits, 0 for none, else 1 + its place in chess.promotePieces). Moves are
+# decoded without replaying the game.
+# Each game is a little-endian header of move count (16 bits) and result
+# (8 bits, its place in RESULTS), followed by its moves.
+
+gameHeader = struct.Struct("<HB")
+
+def encodeMove(text):
+    fromIndex   = chess.coordsToIndex(chess.algToCoords(text[0:2]))
+    toIndex     = chess.coordsToIndex(chess.algToCoords(text[2:4]))
+    promotion   = 0
+
+    if len(text) == 5:
+        promotion = 1 + chess.promotePieces.index(letterToPiece[text[4].upper()])
+
+    return fromIndex | (toIndex << 6) | (promotion << 12)
+
+def decodeMove(code):
+    text = chess.coordsToAlg(chess.indexCoords[code & 0b111111]) + \
+        chess.coordsToAlg(chess.indexCoords[(code >> 6) & 0b111111])
+
+    promotion = code >> 12
+    if promotion != 0:
+        text += chess.pieceToLetter(chess.promotePieces[promotion - 1]).lower()
+
+    return text
+
+# Writes each game of games to the binary file binFile as it arrives. Headers
+# are not stored. Returns the number of games written
+def writeBinary(binFile, games):
+    count = 0
+    for headers, moves, result in games:
+        codes = [encodeMove(text) for text in moves]
+
+        binFile.write(gameHeader.pack(len(codes), RESULTS.index(result)))
+        binFile.write(struct.pack("<{}H".format(len(codes)), *codes))
+        count += 1
+
+    return count
+
+# Yields the games of the binary file binFile one at a time
+def readBinary(binFile):
+    while True:
+        header = binFile.read(gameHeader.size)
+        if len(header) < gameHeader.size:
+            return
+
+        numMoves, resultIndex = gameHeader.unpack(header)
+        codes = struct.unpack("<{}H".format(numMoves), binFile.read(2 * numMoves))
+
+        yield dict(), [decodeMove(code) for code in codes], RESULTS[resultIndex]
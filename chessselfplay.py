@@ -0,0 +1,193 @@
+import chess
+import chessbot
+import chesspgn
+import concurrent.futures
+import random
+import sys
+import time
+
+
+# Games still going after this many plies are drawn
+MAXPLIES = 400
+
+# Outcomes, as written in PGN
+WHITEWIN    = "1-0"
+BLACKWIN    = "0-1"
+DRAW        = "1/2-1/2"
+
+# Players are given as text so they can be sent to worker processes:
+#   "random"            random legal move
+#   "search:<depth>"    chessbot.search to a fixed depth, e.g. "search:3"
+#   "search:<ms>ms"     chessbot.search for a fixed time, e.g. "search:200ms"
+# Returns (player, searcher): a function taking a gamestate and returning the
+# move to play, and the chessbot.Searcher it uses (None for random), so a
+# search in progress can be stopped
+def makePlayer(spec):
+
+    name, _, arg = spec.partition(":")
+
+    if name == "random":
+        return chessbot.getRandomMove, None
+
+    if name == "search":
+        searcher = chessbot.Searcher()
+
+        if arg.endswith("ms"):
+            timeMs = int(arg[:-2])
+            return (lambda gs: searcher.search(gs, timeMs=timeMs).getBestMove()), searcher
+
+        maxDepth = int(arg) if arg else chessbot.DEFAULTDEPTH
+        return (lambda gs: searcher.search(gs, maxDepth=maxDepth).getBestMove()), searcher
+
+    raise Exception("Unknown player {}".format(spec))
+
+
+class GameResult():
+
+    def __init__(self, gameIndex, seed, white, black, moves, outcome, seconds):
+        self.gameIndex  = gameIndex
+        self.seed       = seed
+        self.white      = white
+        self.black      = black
+        self.moves      = moves
+        self.outcome    = outcome
+        self.seconds    = seconds
+
+    # Moves played, as written by chess.moveToCoordString
+    def getMoves(self):
+        return self.moves
+
+    def getOutcome(self):
+        return self.outcome
+
+    def getLength(self):
+        return len(self.moves)
+
+    # PGN tags for the game
+    def getHeaders(self):
+        return {"Event": "Self-play", "Round": str(self.gameIndex + 1),
+                "White": self.white, "Black": self.black, "Result": self.outcome}
+
+    # The game as (headers, moves, result), for chesspgn's writers
+    def getGame(self):
+        return self.getHeaders(), self.moves, self.outcome
+
+    # Player spec that won, or None for a draw
+    def getWinner(self):
+        if self.outcome == WHITEWIN:
+            return self.white
+        if self.outcome == BLACKWIN:
+            return self.black
+        return None
+
+    def __str__(self):
+        return "game {} {} vs {}: {} in {} plies, {:.2f}s".format(
+            self.gameIndex, self.white, self.black, self.outcome, self.getLength(), self.seconds)
+
+
+# Plays one game from the start position. The side to move wins when it has
+# no legal moves (including having no pieces). A threefold repetition or
+# reaching maxPlies is a draw
+def playGame(white, black, seed, gameIndex=0, maxPlies=MAXPLIES):
+
+    startTime = time.perf_counter()
+    random.seed(seed)
+
+    players = {chess.WHITE: makePlayer(white)[0], chess.BLACK: makePlayer(black)[0]}
+
+    gs = chess.CompactGamestate()
+    gs.default()
+
+    moves       = []
+    seen        = {gs.getHash(): 1}
+    outcome     = DRAW
+
+    while len(moves) < maxPlies:
+        colour = gs.getTurnPlayer()
+
+        if not any(True for move in gs.generateLegalMoves(colour)):
+            outcome = WHITEWIN if colour == chess.WHITE else BLACKWIN
+            break
+
+        move = players[colour](gs)
+        gs.makeMove(move)
+        moves.append(chess.moveToCoordString(move))
+
+        key         = gs.getHash()
+        seen[key]   = seen.get(key, 0) + 1
+        if seen[key] >= 3:
+            break
+
+    return GameResult(gameIndex, seed, white, black, moves, outcome, time.perf_counter() - startTime)
+
+# Plays numGames between playerA and playerB across a pool of worker
+# processes, yielding each GameResult as soon as its game finishes (not in
+# game order). Game i uses seed + i, so any game can be replayed alone with
+# playGame. With alternate, playerA is white in even games, black in odd ones
+def selfplay(numGames, playerA, playerB, workers=None, seed=0, alternate=True, maxPlies=MAXPLIES):
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+
+        for gameIndex in range(0, numGames):
+            if alternate and gameIndex % 2 == 1:
+                white, black = playerB, playerA
+            else:
+                white, black = playerA, playerB
+
+            futures.append(pool.submit(playGame, white, black, seed + gameIndex, gameIndex, maxPlies))
+
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+# python chessselfplay.py numGames playerA playerB [workers] [seed] [outFile]
+# Games are appended to outFile as they finish, as PGN, or in chesspgn's
+# binary format if its name ends in .bin
+if __name__ == "__main__":
+
+    args        = sys.argv[1:]
+    numGames    = int(args[0]) if len(args) > 0 else 10
+    playerA     = args[1] if len(args) > 1 else "random"
+    playerB     = args[2] if len(args) > 2 else "random"
+    workers     = int(args[3]) if len(args) > 3 else None
+    seed        = int(args[4]) if len(args) > 4 else 0
+    outPath     = args[5] if len(args) > 5 else None
+
+    outFile = None
+    if outPath is not None:
+        if outPath.endswith(".bin"):
+            outFile, writeGames = open(outPath, "ab"), chesspgn.writeBinary
+        else:
+            outFile, writeGames = open(outPath, "a"), chesspgn.writePgn
+
+    winsA       = 0
+    winsB       = 0
+    draws       = 0
+    startTime   = time.perf_counter()
+
+    for result in selfplay(numGames, playerA, playerB, workers, seed):
+        print(result)
+
+        if outFile is not None:
+            writeGames(outFile, [result.getGame()])
+
+        # playerA is white in even games
+        aIsWhite = result.gameIndex % 2 == 0
+        if result.getOutcome() == DRAW:
+            draws += 1
+        elif (result.getOutcome() == WHITEWIN) == aIsWhite:
+            winsA += 1
+        else:
+            winsB += 1
+
+    if outFile is not None:
+        outFile.close()
+
+    seconds = time.perf_counter() - startTime
+    print("{} games in {:.2f}s ({:.2f} games/s)".format(numGames, seconds, numGames / seconds))
+    print("A ({}) wins {}, B ({}) wins {}, draws {}".format(playerA, winsA, playerB, winsB, draws))
@@ -0,0 +1,112 @@
+# Fixed-size transposition table for searching gamestates, keyed by
+# Gamestate.getHash()
+
+# Bound types of a stored score
+EXACT   = 0
+LOWER   = 1     # Score is at least the stored value (fail high)
+UPPER   = 2     # Score is at most the stored value (fail low)
+
+# Rough cost in bytes of one entry: a list slot, and a 5-tuple with its ints
+ENTRYSIZE = 192
+
+# Each bucket holds two entries. The first slot is depth-preferred and is
+# only replaced by an entry searched at least as deep, the second slot is
+# always replaced. Entries are tuples (key, depth, bound, score, move), with
+# the move as a chess.moveToCode int so entries keep no Move objects alive.
+class TranspositionTable():
+
+    def __init__(self, sizeMB=16):
+
+        # Round the bucket count down to a power of 2, so the index is a mask
+        maxBuckets  = max(1, int(sizeMB * 1024 * 1024) // (2 * ENTRYSIZE))
+        numBuckets  = 1 << (maxBuckets.bit_length() - 1)
+
+        self.sizeMB     = sizeMB
+        self.numBuckets = numBuckets
+        self.mask       = numBuckets - 1
+        self.entries    = [None] * (2 * numBuckets)
+
+        self.hits       = 0
+        self.misses     = 0
+        self.stores     = 0
+        self.overwrites = 0
+
+    # Returns the entry stored for key, or None
+    def probe(self, key):
+        slot    = (key & self.mask) << 1
+        entries = self.entries
+
+        entry = entries[slot]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+
+        entry = entries[slot + 1]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        return None
+
+    # Returns the best move code stored for key without touching the counters
+    def getMove(self, key):
+        slot    = (key & self.mask) << 1
+
+        for entry in self.entries[slot:slot + 2]:
+            if entry is not None and entry[0] == key:
+                return entry[4]
+
+        return None
+
+    # move is a chess.moveToCode int, or None
+    def store(self, key, depth, bound, score, move=None):
+        slot    = (key & self.mask) << 1
+        entries = self.entries
+
+        # Keep the previous best move if this search didn't find one
+        if move is None:
+            move = self.getMove(key)
+
+        newEntry = (key, depth, bound, score, move)
+        oldEntry = entries[slot]
+
+        if oldEntry is None or oldEntry[0] == key or depth >= oldEntry[1]:
+            # Drop any older copy of key, so the bucket never holds it twice
+            alwaysEntry = entries[slot + 1]
+            if alwaysEntry is not None and alwaysEntry[0] == key:
+                entries[slot + 1] = None
+
+            entries[slot] = newEntry
+
+        else:
+            oldEntry = entries[slot + 1]
+            entries[slot + 1] = newEntry
+
+        self.stores += 1
+        if oldEntry is not None and oldEntry[0] != key:
+            self.overwrites += 1
+
+    def clear(self):
+        self.entries    = [None] * (2 * self.numBuckets)
+        self.resetStats()
+
+    def resetStats(self):
+        self.hits       = 0
+        self.misses     = 0
+        self.stores     = 0
+        self.overwrites = 0
+
+    def getStats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "stores": self.stores, "overwrites": self.overwrites}
+
+    # Per mille of the first 1000 buckets in use, as UCI engines report it
+    def hashfull(self):
+        sample  = self.entries[:2000]
+        used    = sum(1 for entry in sample if entry is not None)
+
+        return (used * 1000) // len(sample)
+
+    def __len__(self):
+        return 2 * self.numBuckets
@@ -0,0 +1,425 @@
+import chess
+import chessmasks as cm
+import array
+import concurrent.futures
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+
+
+# Antichess endgame tablebases.
+#
+# One file per material signature, named like "KRvN.actb" (white's pieces,
+# "v", black's pieces). It holds a signed 16-bit value for every placement of
+# the pieces and side to move, from the side to move's view:
+#   0           draw
+#   d + 1       win in d plies
+#   -(d + 1)    loss in d plies
+#   INVALID     not a position (pieces overlapping, pawn on a back row...)
+#
+# A position's place in the file is turn + 2 * (s0 + 64*s1 + 64*64*s2 ...),
+# where si is the board index of the i-th piece of the signature (white's
+# first, each side in signatureOrder). Squares of identical pieces are
+# ascending, the order a bit scan finds them in.
+#
+# Positions with a capturable en passant square are not stored. Probing
+# one looks one ply ahead, where all moves are captures into smaller tables.
+
+DRAW    = 0
+INVALID = -32768
+
+HEADER  = struct.Struct("<4sHH")    # magic, number of pieces, reserved
+MAGIC   = b"ACTB"
+
+signatureOrder  = [chess.KING, chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT, chess.PAWN]
+pieceLetters    = {chess.KING: "K", chess.QUEEN: "Q", chess.ROOK: "R",
+                   chess.BISHOP: "B", chess.KNIGHT: "N", chess.PAWN: "P"}
+letterPieces    = {letter: pieceType for pieceType, letter in pieceLetters.items()}
+
+def winCode(distance):
+    return distance + 1
+
+def lossCode(distance):
+    return -(distance + 1)
+
+def isWin(code):
+    return code > 0 and code != INVALID
+
+def isLoss(code):
+    return code < 0 and code != INVALID
+
+def getDistance(code):
+    return abs(code) - 1
+
+# Value of a position from the side that moved into it: the child's win
+# is the parent's loss one ply later and so on
+def parentCode(childCode):
+    if childCode > 0:
+        return lossCode(childCode)
+    if childCode < 0:
+        return winCode(-childCode)
+    return DRAW
+
+# Best of the values of a position's moves, each already from its own view:
+# the quickest win, else a draw, else the slowest loss
+def bestCode(codes):
+    best = None
+    for code in codes:
+        if best is None:
+            best = code
+        elif code > 0:
+            if best <= 0 or code < best:
+                best = code
+        elif code == 0:
+            if best < 0:
+                best = code
+        elif best < 0 and code < best:
+            best = code
+
+    return best
+
+
+# SIGNATURES
+
+def getSignature(gs):
+    sides = []
+    for colour in chess.colourArray:
+        side = ""
+        for pieceType in signatureOrder:
+            side += pieceLetters[pieceType] * countBits(gs.getBits(pieceType | colour))
+        sides.append(side)
+
+    return "v".join(sides)
+
+# The signature's pieces as piece codes, in the order they are indexed
+def signaturePieces(signature):
+    whiteSide, blackSide = signature.split("v")
+    return [letterPieces[letter] | chess.WHITE for letter in whiteSide] + \
+        [letterPieces[letter] | chess.BLACK for letter in blackSide]
+
+def countBits(bits):
+    return bin(bits).count("1")
+
+# Every signature with both sides having pieces, up to maxPieces in total,
+# in an order where each table's captures and promotions come before it
+def allSignatures(maxPieces):
+    signatures = []
+    for total in range(2, maxPieces + 1):
+        for whiteCount in range(1, total):
+            for whiteSide in itertools.combinations_with_replacement(signatureOrder, whiteCount):
+                for blackSide in itertools.combinations_with_replacement(signatureOrder, total - whiteCount):
+                    signatures.append("".join(pieceLetters[p] for p in whiteSide) + "v" +
+                                      "".join(pieceLetters[p] for p in blackSide))
+
+    return sorted(signatures, key=getLevel)
+
+# Tables at the same level never depend on each other: captures lower the
+# piece count, and promotions keep it but lower the pawn count
+def getLevel(signature):
+    return (len(signature) - 1, signature.count("P"))
+
+def getFileName(directory, signature):
+    return os.path.join(directory, signature + ".actb")
+
+
+# PROBING
+
+# Squares an en passant capture could be made on by the side to move
+def capturableEnPassant(gs):
+    colour      = gs.getTurnPlayer()
+    oppColour   = chess.invColour(colour)
+    pawnAttacks = cm.getPawnAttacks(colour, gs.getBits(chess.PAWN | colour))
+
+    return gs.getEnPassant(oppColour) & pawnAttacks
+
+def getIndex(gs, pieces):
+    index   = 0
+    factor  = 2
+    lastPiece, lastBits = None, 0
+
+    for piece in pieces:
+        if piece != lastPiece:
+            lastPiece, lastBits = piece, gs.getBits(piece)
+
+        lowBit      = lastBits & -lastBits
+        lastBits    ^= lowBit
+        index       += factor * (lowBit.bit_length() - 1)
+        factor      *= 64
+
+    return index + (1 if gs.getTurnPlayer() == chess.BLACK else 0)
+
+
+# Memory maps table files as they are first needed, with no parsing
+class Tablebase():
+
+    def __init__(self, directory):
+        self.directory  = directory
+        self.tables     = dict()
+        self.pieces     = dict()
+
+        self.maxPieces  = 0
+        if os.path.isdir(directory):
+            for fileName in os.listdir(directory):
+                if fileName.endswith(".actb"):
+                    self.maxPieces = max(self.maxPieces, len(fileName) - len(".actb") - 1)
+
+    def getTable(self, signature):
+        if signature not in self.tables:
+            table = None
+            fileName = getFileName(self.directory, signature)
+
+            if os.path.exists(fileName):
+                with open(fileName, "rb") as tableFile:
+                    table = mmap.mmap(tableFile.fileno(), 0, access=mmap.ACCESS_READ)
+                if HEADER.unpack_from(table, 0)[0] != MAGIC:
+                    raise Exception("{} is not a tablebase file".format(fileName))
+
+            self.tables[signature] = table
+            self.pieces[signature] = signaturePieces(signature)
+
+        return self.tables[signature]
+
+    # Returns the value of gs for the side to move, or None if no table
+    # covers it
+    def probeCode(self, gs):
+        colour = gs.getTurnPlayer()
+
+        # A side with no pieces left has won
+        if gs.getBits(colour | chess.ALL) == 0:
+            return winCode(0)
+
+        if capturableEnPassant(gs):
+            codes = []
+            for move in gs.getLegalMoveList(colour):
+                gs.makeMove(move)
+                code = self.probeCode(gs)
+                gs.unmakeMove()
+
+                if code is None:
+                    return None
+                codes.append(parentCode(code))
+
+            return bestCode(codes)
+
+        signature = getSignature(gs)
+        table = self.getTable(signature)
+        if table is None:
+            return None
+
+        index = getIndex(gs, self.pieces[signature])
+        return struct.unpack_from("<h", table, HEADER.size + 2 * index)[0]
+
+    # Returns (code, distance) where code is 1 for a win, -1 for a loss and
+    # 0 for a draw, or None if no table covers gs
+    def probe(self, gs):
+        code = self.probeCode(gs)
+        if code is None:
+            return None
+        if code == DRAW:
+            return (0, 0)
+
+        return (1 if code > 0 else -1, getDistance(code))
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = dict()
+
+
+# GENERATION
+
+# Yields (index, boards, mailbox) for every valid placement of pieces, white
+# to move. The boards and mailbox are as a CompactGamestate holds them
+def placements(pieces):
+
+    # Identical pieces are placed as ascending combinations of squares
+    groups = [(piece, len(list(group))) for piece, group in itertools.groupby(pieces)]
+    choices = []
+    for piece, count in groups:
+        squares = range(8, 56) if chess.getPieceType(piece) == chess.PAWN else range(0, 64)
+        choices.append(list(itertools.combinations(squares, count)))
+
+    for combination in itertools.product(*choices):
+        boards      = [0b0] * ((chess.BOTH | chess.ALL) + 1)
+        mailbox     = bytearray(64)
+        index       = 0
+        factor      = 2
+        valid       = True
+
+        for (piece, count), squares in zip(groups, combination):
+            for square in squares:
+                bit = 0b1 << square
+                if boards[chess.BOTH | chess.ALL] & bit:
+                    valid = False
+                    break
+
+                boards[piece]                       |= bit
+                boards[(piece & 0b11) | chess.ALL]  |= bit
+                boards[chess.BOTH | chess.ALL]      |= bit
+                mailbox[square] = piece
+                index   += factor * square
+                factor  *= 64
+
+            if not valid:
+                break
+
+        if valid:
+            yield index, boards, mailbox
+
+# Solves one signature and writes its table file. Tables for its captures and
+# promotions must already be in directory
+def generateTable(signature, directory):
+
+    startTime   = time.perf_counter()
+    pieces      = signaturePieces(signature)
+    size        = 2 * 64 ** len(pieces)
+    tablebase   = Tablebase(directory)
+
+    values      = array.array("h", [INVALID]) * size
+    remaining   = array.array("I", [0]) * size      # Unsolved moves within this table
+    lossDist    = array.array("H", [0]) * size      # Slowest loss among solved moves
+    canLose     = bytearray(size)                   # No move outside the table avoids losing
+
+    edgeFrom    = array.array("I")
+    edgeTo      = array.array("I")
+    buckets     = [[]]
+
+    def schedule(index, code):
+        distance = getDistance(code)
+        while len(buckets) <= distance:
+            buckets.append([])
+        buckets[distance].append((index, code))
+
+    # Generate every position's moves. Moves leaving the table (captures,
+    # promotions, capturable en passant) are valued now from smaller tables;
+    # moves staying in it become edges for the retrograde pass
+    gs = chess.CompactGamestate()
+    for whiteIndex, boards, mailbox in placements(pieces):
+        for turn in chess.colourArray:
+            index = whiteIndex + (1 if turn == chess.BLACK else 0)
+
+            gs.boards       = boards[:]
+            gs.mailbox      = mailbox[:]
+            gs.turn         = turn
+            gs.undoStack    = []
+            gs.legalCache   = None
+
+            moves = gs.getLegalMoveList(turn)
+            if len(moves) == 0:
+                values[index] = DRAW
+                schedule(index, winCode(0))
+                continue
+
+            outCodes = []
+            for move in moves:
+                undo = gs.makeMove(move)
+
+                if undo.capPiece != chess.NONE or undo.promotion != chess.NONE or capturableEnPassant(gs):
+                    outCodes.append(parentCode(tablebase.probeCode(gs)))
+                else:
+                    edgeFrom.append(index)
+                    edgeTo.append(getIndex(gs, pieces))
+                    remaining[index] += 1
+
+                gs.unmakeMove()
+
+            values[index] = DRAW
+            best = bestCode(outCodes)
+
+            if best is None or best < 0:
+                canLose[index]  = 1
+                lossDist[index] = getDistance(best) if best is not None else 0
+
+            if best is not None and best > 0:
+                schedule(index, best)
+            elif remaining[index] == 0 and best is not None and best < 0:
+                schedule(index, best)
+
+    tablebase.close()
+
+    # Predecessors of each position, grouped by position (counting sort)
+    predStart = array.array("I", [0]) * (size + 1)
+    for to in edgeTo:
+        predStart[to + 1] += 1
+    for index in range(0, size):
+        predStart[index + 1] += predStart[index]
+
+    preds   = array.array("I", [0]) * len(edgeTo)
+    fill    = predStart[:]
+    for edge in range(0, len(edgeTo)):
+        to = edgeTo[edge]
+        preds[fill[to]] = edgeFrom[edge]
+        fill[to] += 1
+    del edgeFrom, edgeTo, fill
+
+    # Retrograde pass, in order of distance: a move to a lost position wins,
+    # and a position whose every move reaches a won one is lost
+    solved = bytearray(size)
+    distance = 0
+    while distance < len(buckets):
+        for index, code in buckets[distance]:
+            if solved[index]:
+                continue
+            solved[index]   = 1
+            values[index]   = code
+
+            for pred in preds[predStart[index]:predStart[index + 1]]:
+                if solved[pred]:
+                    continue
+
+                if code < 0:
+                    schedule(pred, winCode(distance + 1))
+                else:
+                    remaining[pred] -= 1
+                    if distance + 1 > lossDist[pred]:
+                        lossDist[pred] = distance + 1
+                    if remaining[pred] == 0 and canLose[pred]:
+                        schedule(pred, lossCode(lossDist[pred]))
+
+        buckets[distance] = None
+        distance += 1
+
+    # Write to a temporary file first, so an interrupted run leaves no table
+    fileName    = getFileName(directory, signature)
+    tempName    = fileName + ".tmp"
+    with open(tempName, "wb") as tableFile:
+        tableFile.write(HEADER.pack(MAGIC, len(pieces), 0))
+        if sys.byteorder != "little":
+            values.byteswap()
+        tableFile.write(values.tobytes())
+    os.replace(tempName, fileName)
+
+    return signature, time.perf_counter() - startTime
+
+# Generates every table up to maxPieces into directory. Tables already there
+# are kept, so an interrupted run can be restarted. Each level of tables is
+# spread across a pool of worker processes
+def generateTablebases(directory, maxPieces=3, workers=None):
+
+    os.makedirs(directory, exist_ok=True)
+    signatures = allSignatures(maxPieces)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for level, group in itertools.groupby(signatures, key=getLevel):
+            todo = [signature for signature in group
+                    if not os.path.exists(getFileName(directory, signature))]
+
+            futures = [pool.submit(generateTable, signature, directory) for signature in todo]
+            for future in concurrent.futures.as_completed(futures):
+                signature, seconds = future.result()
+                print("{} generated in {:.1f}s".format(signature, seconds))
+
+
+# python chesstablebase.py directory [maxPieces] [workers]
+if __name__ == "__main__":
+
+    args        = sys.argv[1:]
+    directory   = args[0] if len(args) > 0 else "tablebases"
+    maxPieces   = int(args[1]) if len(args) > 1 else 3
+    workers     = int(args[2]) if len(args) > 2 else None
+
+    generateTablebases(directory, maxPieces, workers)
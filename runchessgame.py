@@ -1,42 +1,114 @@
+import time
+startTime = time.perf_counter()
+
 import chess
 import chessbot
+import chesspgn
+import chessselfplay
+import chesstable
+import os
+import queue
+import sys
+import threading
 import tkinter as tk
-import time
-from PIL import ImageTk, Image
-from playsound import playsound
+import tkinter.filedialog
 
 SQUARESIZE = 100
 boardColour = {0: "#769656", 1: "#eeeed2"}
 
+# Milliseconds the search bot may think for, and between checks for its move
+THINKTIMEMS = 1000
+BOTPOLLMS   = 50
+
+# Milliseconds between frames of bot-vs-bot and replay playback, and the
+# players that can be chosen for it (as chessselfplay.makePlayer specs)
+FRAMEMS         = 16
+PLAYERCHOICES   = ["random", "search:1", "search:2", "search:3", "search:200ms", "search:1000ms"]
 
-root = tk.Tk()
-root.title("Anti-Chess")
-root.resizable(False, False)
 
-canv = tk.Canvas(root)
+imageDir    = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+spriteDir   = os.path.join(imageDir, "cache", str(SQUARESIZE))
 
-# Initialises dictionary of images
+# Piece images, loaded as they are first drawn
 pieceImages = dict()
-for piece in chess.pieceArray:
-    for colour in chess.colourArray:
-        img = Image.open("images/" + str(piece+colour) + ".png").resize((SQUARESIZE, SQUARESIZE))
-        pieceImages[piece+colour] = ImageTk.PhotoImage(img)
+
+def getPieceImage(piece):
+    if piece not in pieceImages:
+        pieceImages[piece] = loadSprite(piece)
+    return pieceImages[piece]
+
+# Sprites are resized to SQUARESIZE once, by PIL, and kept as PNGs in
+# images/cache/<SQUARESIZE> for Tk to load directly on later runs. PIL is
+# only imported to fill the cache; without it, Tk scales the originals
+def loadSprite(piece):
+    fileName    = str(piece) + ".png"
+    spritePath  = os.path.join(spriteDir, fileName)
+    
+    if not os.path.exists(spritePath):
+        try:
+            from PIL import Image
+        except ImportError:
+            return scaleSprite(os.path.join(imageDir, fileName))
+        
+        # Written under a temporary name first, as other sessions may be
+        # reading the cache
+        os.makedirs(spriteDir, exist_ok=True)
+        tempPath = "{}.{}.tmp".format(spritePath, os.getpid())
+        Image.open(os.path.join(imageDir, fileName)).resize((SQUARESIZE, SQUARESIZE)).save(tempPath, "PNG")
+        os.replace(tempPath, spritePath)
+        
+    return tk.PhotoImage(file=spritePath)
+
+# Scales an image to SQUARESIZE by Tk's whole number zoom and subsample
+def scaleSprite(path):
+    image   = tk.PhotoImage(file=path)
+    size    = image.width()
+    common  = gcd(SQUARESIZE, size)
+    
+    return image.zoom(SQUARESIZE // common).subsample(size // common)
+
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+# The canvas holds one rectangle and one image item per square, created once
+# by drawBlankBoard. Everything after that changes them with itemconfig, and
+# only for squares whose contents have changed, so the canvas never grows
+squareItems = dict()    # pos: rectangle item
+pieceItems  = dict()    # pos: image item, hidden on an empty square
+shownPieces = dict()    # pos: piece its image item is showing
+highlighted = set()     # positions drawn selected
+
+HIGHLIGHTCOLOUR = "#CCCC00"
 
 # Draws a plain checkerboard
 def drawBlankBoard(canvas):
 
-    for i in range(0,8):
-        for j in range(0,8):
-            resetSquare(canvas, (i,j))
+    if not squareItems:
+        for i in range(0,8):
+            for j in range(0,8):
+                squareItems[(i,j)] = canvas.create_rectangle(*rectAt(i,j), fill=boardColour[(i+j) % 2], outline="")
+                pieceItems[(i,j)]  = canvas.create_image(i*SQUARESIZE, j*SQUARESIZE, anchor=tk.NW, state=tk.HIDDEN)
+                shownPieces[(i,j)] = chess.NONE
+
+    clearHighlights(canvas)
+    for pos in squareItems:
+        drawPiece(canvas, chess.NONE, pos)
 
     return canvas
 
+def clearHighlights(canvas):
+    for pos in list(highlighted):
+        resetSquare(canvas, pos)
+
 # Resets the colour of the square at pos, and redraws piece (if given)
 def resetSquare(canvas, pos, piece=None):
     i,j = pos
     
-    colour = boardColour[(i+j) % 2]
-    canvas.create_rectangle(*rectAt(i,j), fill=colour, outline="")
+    if pos in highlighted:
+        canvas.itemconfig(squareItems[pos], fill=boardColour[(i+j) % 2])
+        highlighted.discard(pos)
     
     if piece != None:
         drawPiece(canvas, piece, pos)
@@ -46,28 +118,38 @@ def resetSquare(canvas, pos, piece=None):
 def rectAt(x,y):
     return (x*SQUARESIZE, y*SQUARESIZE, (x+1)*SQUARESIZE, (y+1)*SQUARESIZE)
 
+# Shows piece on the square at pos, or nothing for chess.NONE
 def drawPiece(canvas, piece, pos):
-    x,y = pos
+    if shownPieces[pos] == piece:
+        return
+    
     if piece != chess.NONE:
-        canvas.create_image(100*x, 100*y, anchor=tk.NW, image=pieceImages[piece])
+        canvas.itemconfig(pieceItems[pos], image=getPieceImage(piece), state=tk.NORMAL)
+    else:
+        canvas.itemconfig(pieceItems[pos], state=tk.HIDDEN)
+    shownPieces[pos] = piece
 
 # Highlights the square at pos
 def selectSquare(canvas, piece, pos):
-    x,y = pos
-    canvas.create_rectangle(*rectAt(x,y), fill="#CCCC00",  outline="")
+    canvas.itemconfig(squareItems[pos], fill=HIGHLIGHTCOLOUR)
+    highlighted.add(pos)
     drawPiece(canvas, piece, pos)
     
 # moves piece from fromPos to toPos on the canvas and gamestate
-def movePiece(gamestate, canvas, piece, fromPos, toPos):
-    move = chess.Move(piece, fromPos, toPos)
+# promotion is the piece type a pawn becomes, if it reaches the last row
+def movePiece(gamestate, canvas, piece, fromPos, toPos, promotion=chess.NONE):
+    move = chess.Move(piece, fromPos, toPos, promotion=promotion)
     gamestate.makeMove(move)
 
     for pos in [fromPos, toPos]:
         resetSquare(canvas, pos)
 
-    drawPiece(canvas, piece, toPos)
+    # An en passant capture also empties a third square, so every square is
+    # compared, but only changed ones are redrawn
+    drawGamestate(canvas, gamestate)
 
-# Draws a board representation of gamestate onto canvas
+# Draws a board representation of gamestate onto canvas, changing only the
+# squares that differ from what is shown
 def drawGamestate(canvas, gamestate):
     for i in range(0,8):
         for j in range(0,8):
@@ -84,10 +166,12 @@ def touchPiece(event):
     global gamestate
     
     playerColour = gamestate.getTurnPlayer()
-
-    print(lastPos)
     
-    nextPos = (event.x // 100, event.y // 100)
+    # The board is the bot's until it has moved
+    if botThread is not None or playbackRunning:
+        return
+    
+    nextPos = (event.x // SQUARESIZE, event.y // SQUARESIZE)
     
     if 0<= nextPos[0] <= 7 and 0 <= nextPos[1] <= 8:
     
@@ -108,8 +192,8 @@ def touchPiece(event):
             # If Legal move is attempted
             if gamestate.isLegalMove(lastPiece, lastPos, nextPos):
                 
-                movePiece(gamestate, canvas, lastPiece, lastPos, nextPos)
                 x,y = nextPos
+                promotePieceType = chess.NONE
                 
                 if chess.getPieceType(lastPiece) == chess.PAWN and y in [0,7]:
                     
@@ -117,16 +201,12 @@ def touchPiece(event):
                     # Promote to Queen for now
                     promotePieceType = chess.QUEEN
                     
-                    lastColour = chess.getColour(lastPiece)
-                    gamestate.promotePiece(lastColour, promotePieceType, nextPos)
-                    resetSquare(canvas, nextPos, promotePieceType + lastColour)
+                movePiece(gamestate, canvas, lastPiece, lastPos, nextPos, promotePieceType)
                     
                 lastPos = None
                 lastPiece = None
                 
-                root.update()
-                
-                root.after(1000, botResponse())
+                botResponse()
                 
             # If Illegal move is attempted
             else:
@@ -145,8 +225,15 @@ def touchPiece(event):
 def resetGame(event):
     global canvas
     global gamestate
+    global lastPos
+    global lastPiece
     
-    drawBlankBoard(canvas)
+    cancelBot()
+    stopPlayback()
+    lastPos = None
+    lastPiece = None
+    
+    clearHighlights(canvas)
     gamestate.default()
     drawGamestate(canvas, gamestate)
     
@@ -155,49 +242,363 @@ def randomMove(event):
     global gamestate
     
     move = chessbot.getRandomMove(gamestate)
-    movePiece(gamestate, canvas, *move.unpack())
+    movePiece(gamestate, canvas, *move.unpack(), move.getPromotion())
     
     
 def setBotRandom(event):
     global aiMode
     aiMode = "Random"
     
+def setBotSearch(event):
+    global aiMode
+    aiMode = "Search"
+    
 def setBotOff(event):
     global aiMode
     aiMode = "Off"
     
 aiMode = "Off"
+
+# The bot thinks in a worker thread on a copy of the gamestate, and puts
+# (job, move) on botResults. The Tk thread polls for it with root.after, so
+# the window stays responsive. Each request gets a new job number, so a move
+# for a game that has since been reset is recognised and dropped.
+# Each job has its own Searcher, sharing one transposition table
+botTable    = chesstable.TranspositionTable()
+botResults  = queue.Queue()
+botThread   = None
+botSearcher = None
+botJob      = 0
+
+def botWorker(job, gs, mode, searcher, thinkTimeMs):
+    if mode == "Search":
+        move = searcher.search(gs, timeMs=thinkTimeMs).getBestMove()
+    else:
+        move = chessbot.getRandomMove(gs)
+        
+    botResults.put((job, move))
     
 def botResponse():
+    global botThread
+    global botSearcher
+    global botJob
     
     if aiMode == "Off":
         return
     
-    if aiMode == "Random":
-        randomMove(None)
+    if not gamestate.getLegalMoveList(gamestate.getTurnPlayer()):
+        return
+    
+    botJob += 1
+    botSearcher = chessbot.Searcher(botTable)
+    botThread = threading.Thread(target=botWorker, daemon=True,
+                                 args=(botJob, gamestate.copy(), aiMode, botSearcher, thinkTimeScale.get()))
+    botThread.start()
+    
+    statusLabel.config(text="Thinking\u2026")
+    root.after(BOTPOLLMS, pollBot, botJob)
+    
+def pollBot(job):
+    global botThread
+    
+    if botThread is None or job != botJob:
+        return
+    
+    # Moves from cancelled jobs are skipped
+    while True:
+        try:
+            resultJob, move = botResults.get_nowait()
+        except queue.Empty:
+            root.after(BOTPOLLMS, pollBot, job)
+            return
+        
+        if resultJob == job:
+            break
+    
+    botThread = None
+    statusLabel.config(text="")
+    
+    if move is not None:
+        movePiece(gamestate, canvas, *move.unpack(), move.getPromotion())
+        
+# Stops the bot's search and ignores whatever move it comes back with
+def cancelBot():
+    global botThread
+    global botJob
+    
+    if botThread is None:
+        return
+    
+    botJob += 1
+    if botSearcher is not None:
+        botSearcher.stop()
+    botThread = None
+    statusLabel.config(text="")
 
-canvas = tk.Canvas(root, width=8 * SQUARESIZE, height=8 * SQUARESIZE)        
-canvas.pack(side=tk.LEFT)
-drawBlankBoard(canvas)
-canvas.bind("<Button-1>", touchPiece)
 
-gamestate = chess.Gamestate()
-gamestate.default()
-drawGamestate(canvas, gamestate)
+# PLAYBACK
+# Two bots play each other, or saved games are replayed, at up to
+# movesPerSecond. Moves owed to the clock build up in playbackDue, and each
+# frame plays all of them before drawing the board once, so fast playback
+# redraws at most once per frame however many moves it makes
+playbackRunning = False
+playbackPaused  = False
+playbackJob     = 0         # Frames of an earlier playback stop themselves
+playbackDue     = 0.0
+playbackClock   = 0.0
+playbackPlayers = None      # colour: (player, searcher) from makePlayer, when bots are playing
+playbackGames   = None      # iterator of (headers, moves, result), when replaying
+playbackMoves   = []        # moves of the game being replayed, next last
+playbackSeen    = dict()    # hash: count, for threefold repetitions
 
-buttonFrame = tk.Frame(root, width = 200, height = 800)
-buttonFrame.pack(side=tk.LEFT)
+def startBotGame(event):
+    global playbackPlayers
+    
+    resetGame(None)
+    playbackPlayers = {chess.WHITE: chessselfplay.makePlayer(whitePlayerVar.get()),
+                       chess.BLACK: chessselfplay.makePlayer(blackPlayerVar.get())}
+    startPlayback()
+    
+# Replays every game in a PGN file, or a chesspgn binary file ending in .bin
+def loadGames(event):
+    global playbackGames
+    
+    path = tkinter.filedialog.askopenfilename(filetypes=[("Game records", "*.pgn *.bin"), ("All files", "*")])
+    if not path:
+        return
+    
+    resetGame(None)
+    if path.endswith(".bin"):
+        playbackGames = chesspgn.readBinary(open(path, "rb"))
+    else:
+        playbackGames = chesspgn.readPgn(open(path))
+        
+    startPlayback()
+    
+def startPlayback():
+    global playbackRunning
+    global playbackJob
+    global playbackDue
+    global playbackClock
+    
+    playbackRunning = True
+    playbackJob     += 1
+    playbackDue     = 0.0
+    playbackClock   = time.perf_counter()
+    playbackSeen.clear()
+    playbackSeen[gamestate.getHash()] = 1
+    
+    root.after(FRAMEMS, playbackFrame, playbackJob)
+    
+def stopPlayback():
+    global playbackRunning
+    global playbackPlayers
+    global playbackGames
+    global playbackMoves
+    
+    playbackRunning = False
+    playbackPlayers = None
+    playbackGames   = None
+    playbackMoves   = []
+    
+def togglePause(event):
+    global playbackPaused
+    
+    playbackPaused = not playbackPaused
+    pauseButton.config(text="Resume" if playbackPaused else "Pause")
+    
+def stepPlayback(event):
+    global playbackDue
+    
+    if playbackRunning and playbackPaused:
+        playbackDue += 1
+    
+def playbackFrame(job):
+    global playbackDue
+    global playbackClock
+    
+    if not playbackRunning or job != playbackJob:
+        return
+    
+    now = time.perf_counter()
+    if not playbackPaused:
+        # Never owe more than a second of moves, so a slow bot is not
+        # followed by a burst
+        movesPerSecond  = movesPerSecondScale.get()
+        playbackDue     = min(playbackDue + (now - playbackClock) * movesPerSecond, max(1, movesPerSecond))
+    playbackClock = now
+    
+    moved = False
+    while playbackDue >= 1 and playbackRunning:
+        if playbackPlayers is not None:
+            if not playBotMove():
+                break
+        else:
+            playReplayMove()
+        playbackDue -= 1
+        moved = True
+        
+    if moved:
+        drawGamestate(canvas, gamestate)
+    
+    if playbackRunning:
+        root.after(FRAMEMS, playbackFrame, job)
+        
+# Plays the bot to move's move if it has one ready, starting it thinking if
+# it has not begun. Returns whether a move was played
+def playBotMove():
+    global botThread
+    global botSearcher
+    global botJob
+    
+    colour = gamestate.getTurnPlayer()
+    
+    if not gamestate.getLegalMoveList(colour):
+        finishGame(chessselfplay.WHITEWIN if colour == chess.WHITE else chessselfplay.BLACKWIN)
+        return False
+    
+    if len(gamestate.undoStack) >= chessselfplay.MAXPLIES or playbackSeen[gamestate.getHash()] >= 3:
+        finishGame(chessselfplay.DRAW)
+        return False
+    
+    if botThread is None:
+        # The player's Searcher is kept so cancelBot can stop it
+        player, botSearcher = playbackPlayers[colour]
+        botJob += 1
+        botThread = threading.Thread(target=playerWorker, daemon=True,
+                                     args=(botJob, gamestate.copy(), player))
+        botThread.start()
+        statusLabel.config(text="Thinking\u2026")
+        return False
+    
+    # Moves from cancelled jobs are skipped
+    while True:
+        try:
+            job, move = botResults.get_nowait()
+        except queue.Empty:
+            return False
+        
+        if job == botJob:
+            break
+        
+    botThread = None
+    statusLabel.config(text="")
+    
+    gamestate.makeMove(move)
+    playbackSeen[gamestate.getHash()] = playbackSeen.get(gamestate.getHash(), 0) + 1
+    
+    return True
+        
+def playerWorker(job, gs, player):
+    botResults.put((job, player(gs)))
+    
+# Plays the next move of the game being replayed. At the end of a game, the
+# final position is shown for one move's time before the next game starts
+def playReplayMove():
+    global playbackMoves
+    
+    if playbackMoves:
+        gamestate.makeMove(chess.coordStringToMove(gamestate, playbackMoves.pop()))
+        return
+    
+    try:
+        headers, moves, result = next(playbackGames)
+    except StopIteration:
+        stopPlayback()
+        return
+    
+    gamestate.default()
+    statusLabel.config(text="{} {}".format(headers.get("Round", ""), result).strip())
+    playbackMoves = moves[::-1]
+    
+# Shows how a bot game ended
+def finishGame(result):
+    statusLabel.config(text=result)
+    stopPlayback()
+
+
+# Builds the window and runs it. With timeStartup, prints the time from the
+# start of the import to the window's first idle moment and closes it
+def main(timeStartup=False):
+    global root
+    global canvas
+    global gamestate
+    global thinkTimeScale
+    global statusLabel
+    global whitePlayerVar
+    global blackPlayerVar
+    global movesPerSecondScale
+    global pauseButton
+    
+    root = tk.Tk()
+    root.title("Anti-Chess")
+    root.resizable(False, False)
+    
+    canvas = tk.Canvas(root, width=8 * SQUARESIZE, height=8 * SQUARESIZE)
+    canvas.pack(side=tk.LEFT)
+    drawBlankBoard(canvas)
+    canvas.bind("<Button-1>", touchPiece)
 
-resetButton = tk.Button(buttonFrame, text="Reset", fg="Black", height=2, width = 16)
-resetButton.bind("<Button-1>", resetGame)
-resetButton.pack(side=tk.BOTTOM, padx=8, pady=8)
+    gamestate = chess.Gamestate()
+    gamestate.default()
+    drawGamestate(canvas, gamestate)
+
+    buttonFrame = tk.Frame(root, width = 200, height = 800)
+    buttonFrame.pack(side=tk.LEFT)
+
+    resetButton = tk.Button(buttonFrame, text="Reset", fg="Black", height=2, width = 16)
+    resetButton.bind("<Button-1>", resetGame)
+    resetButton.pack(side=tk.BOTTOM, padx=8, pady=8)
+
+    resetButton = tk.Button(buttonFrame, text="AI Random", fg="Black", height=2, width = 16)
+    resetButton.bind("<Button-1>", setBotRandom)
+    resetButton.pack(side=tk.TOP, padx=8, pady=8)
+
+    resetButton = tk.Button(buttonFrame, text="AI Search", fg="Black", height=2, width = 16)
+    resetButton.bind("<Button-1>", setBotSearch)
+    resetButton.pack(side=tk.TOP, padx=8, pady=8)
+
+    resetButton = tk.Button(buttonFrame, text="AI Off", fg="Black", height=2, width = 16)
+    resetButton.bind("<Button-1>", setBotOff)
+    resetButton.pack(side=tk.TOP, padx=8, pady=8)
 
-resetButton = tk.Button(buttonFrame, text="AI Random", fg="Black", height=2, width = 16)
-resetButton.bind("<Button-1>", setBotRandom)
-resetButton.pack(side=tk.TOP, padx=8, pady=8)
+    thinkTimeScale = tk.Scale(buttonFrame, label="Think time (ms)", from_=100, to=10000, resolution=100,
+                              orient=tk.HORIZONTAL, length=160)
+    thinkTimeScale.set(THINKTIMEMS)
+    thinkTimeScale.pack(side=tk.TOP, padx=8, pady=8)
+
+    statusLabel = tk.Label(buttonFrame, text="", width=16)
+    statusLabel.pack(side=tk.TOP, padx=8, pady=8)
+
+    whitePlayerVar = tk.StringVar(value="search:2")
+    blackPlayerVar = tk.StringVar(value="random")
+    for label, playerVar in [("White", whitePlayerVar), ("Black", blackPlayerVar)]:
+        tk.Label(buttonFrame, text=label).pack(side=tk.TOP)
+        tk.OptionMenu(buttonFrame, playerVar, *PLAYERCHOICES).pack(side=tk.TOP, padx=8)
+
+    movesPerSecondScale = tk.Scale(buttonFrame, label="Moves per second", from_=1, to=500,
+                                   orient=tk.HORIZONTAL, length=160)
+    movesPerSecondScale.set(2)
+    movesPerSecondScale.pack(side=tk.TOP, padx=8, pady=8)
+
+    for text, command in [("Bot vs Bot", startBotGame), ("Load Game", loadGames), ("Step", stepPlayback)]:
+        playbackButton = tk.Button(buttonFrame, text=text, fg="Black", width = 16)
+        playbackButton.bind("<Button-1>", command)
+        playbackButton.pack(side=tk.TOP, padx=8, pady=2)
+
+    pauseButton = tk.Button(buttonFrame, text="Pause", fg="Black", width = 16)
+    pauseButton.bind("<Button-1>", togglePause)
+    pauseButton.pack(side=tk.TOP, padx=8, pady=2)
+    
+    if timeStartup:
+        def reportStartup():
+            print("startup {:.0f}ms".format(1000 * (time.perf_counter() - startTime)))
+            root.destroy()
+        root.after_idle(reportStartup)
+    
+    root.mainloop()
 
-resetButton = tk.Button(buttonFrame, text="AI Off", fg="Black", height=2, width = 16)
-resetButton.bind("<Button-1>", setBotOff)
-resetButton.pack(side=tk.TOP, padx=8, pady=8)
 
-root.mainloop()
\ No newline at end of file
+# python runchessgame.py [--startup-time]
+if __name__ == "__main__":
+    main("--startup-time" in sys.argv[1:])
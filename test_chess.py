@@ -0,0 +1,559 @@
+import chess
+import chessbook
+import chessbot
+import chesseval
+import chessparallel
+import chessmasks as cm
+import chessperft
+import chesspgn
+import chessselfplay
+import chesstable
+import chesstablebase
+import io
+import pytest
+import random
+import threading
+import time
+
+
+# Checks of precomputed and incrementally kept state against the same state
+# computed from scratch. Run with python -m pytest
+
+gamestateClasses = [chess.Gamestate, chess.CompactGamestate]
+
+GAMES   = 20
+PLIES   = 80
+
+# Attacked squares of a slider found by walking each ray until a blocker
+def walkRays(directions, x, y, occupancy):
+    attacks = 0b0
+    for dx, dy in directions:
+        cx, cy = x + dx, y + dy
+        while 0 <= cx <= 7 and 0 <= cy <= 7:
+            bit = 0b1 << cm.squareIndex(cx, cy)
+            attacks |= bit
+            if occupancy & bit:
+                break
+            cx, cy = cx + dx, cy + dy
+
+    return attacks
+
+@pytest.mark.parametrize("piece, directions", [
+    (cm.ROOK,   cm.rookDirections),
+    (cm.BISHOP, cm.bishopDirections),
+    (cm.QUEEN,  cm.rookDirections + cm.bishopDirections)])
+def testSlidingAttacks(piece, directions):
+    rand = random.Random(0)
+
+    for x in range(0, 8):
+        for y in range(0, 8):
+            for sample in range(0, 50):
+                occupancy = rand.getrandbits(64) & rand.getrandbits(64)
+                assert cm.getSlidingAttacks(piece, cm.squareIndex(x, y), occupancy) ==\
+                    walkRays(directions, x, y, occupancy)
+
+# Bits of the squares (x + dx, y + dy) that are on the board
+def offsetBits(x, y, offsets):
+    bits = 0b0
+    for dx, dy in offsets:
+        if 0 <= x + dx <= 7 and 0 <= y + dy <= 7:
+            bits |= 0b1 << cm.squareIndex(x + dx, y + dy)
+
+    return bits
+
+kingOffsets     = [(dx, dy) for dx in [-1, 0, 1] for dy in [-1, 0, 1] if dx or dy]
+knightOffsets   = [(dx, dy) for dx in [-2, -1, 1, 2] for dy in [-2, -1, 1, 2] if abs(dx) != abs(dy)]
+
+# King masks also hold the king's own square, which is never a target
+def testStepMasks():
+    for x in range(0, 8):
+        for y in range(0, 8):
+            assert cm.getCaptureMask(chess.WHITE | chess.KING, (x, y)) ==\
+                offsetBits(x, y, kingOffsets + [(0, 0)])
+            assert cm.getCaptureMask(chess.BLACK | chess.KNIGHT, (x, y)) == offsetBits(x, y, knightOffsets)
+
+def testBitsToMoveList():
+    rand = random.Random(0)
+
+    for piece in [chess.WHITE | chess.ROOK, chess.BLACK | chess.PAWN]:
+        for sample in range(0, 50):
+            bits = rand.getrandbits(64)
+
+            # The same moves as a scan of every square, promotions included
+            expected = []
+            for index in range(0, 64):
+                if bits & (0b1 << index):
+                    toPos = chess.indexToCoords(index)
+                    if chess.getPieceType(piece) == chess.PAWN and toPos[1] in [0, 7]:
+                        expected += [(toPos, promotion) for promotion in chess.promotePieces]
+                    else:
+                        expected.append((toPos, chess.NONE))
+
+            moves = chess.bitsToMoveList(piece, (3, 3), bits)
+            assert [(move.getToPos(), move.getPromotion()) for move in moves] == expected
+
+# Everything a move changes, to compare a gamestate before and after
+def getState(gs):
+    return ([gs.getBits(colour | pieceType) for colour in chess.colourArray for pieceType in chess.pieceArray],
+            [gs.getEnPassant(colour) for colour in chess.colourArray],
+            gs.turn, gs.hashKey, gs.evalScore, list(gs.mailbox), gs.toFEN())
+
+def checkIncremental(gs):
+    assert gs.getHash() == gs.computeHash()
+    assert gs.evalScore == chesseval.computeEvalScore(gs)
+    assert gs.checkMailbox()
+
+# Returns a gamestate with only the given (piece, x, y) on the board
+def makePosition(gamestateClass, pieces, turn=chess.WHITE):
+    gs = gamestateClass()
+    for piece, x, y in pieces:
+        gs[piece, x, y] = 1
+
+    if turn != gs.getTurnPlayer():
+        gs.changeTurnPlayer()
+
+    return gs
+
+# Plays random games from the start position, calling visit(gs, move) before
+# each move
+def playRandomGames(gamestateClass, visit, seed=0):
+    rand = random.Random(seed)
+
+    for game in range(0, GAMES):
+        gs = gamestateClass()
+        gs.default()
+
+        for ply in range(0, PLIES):
+            moves = gs.getLegalMoveList(gs.getTurnPlayer())
+            if not moves:
+                break
+
+            move = rand.choice(moves)
+            visit(gs, move)
+            gs.makeMove(move)
+
+        yield gs
+
+
+@pytest.mark.parametrize("gamestateClass", gamestateClasses)
+def testIncrementalState(gamestateClass):
+    for gs in playRandomGames(gamestateClass, lambda gs, move: checkIncremental(gs)):
+        checkIncremental(gs)
+
+        while gs.undoStack:
+            gs.unmakeMove()
+            checkIncremental(gs)
+
+@pytest.mark.parametrize("gamestateClass", gamestateClasses)
+def testMakeUnmakeRestoresState(gamestateClass):
+
+    def visit(gs, move):
+        before = getState(gs)
+        gs.makeMove(move)
+        gs.unmakeMove()
+        assert getState(gs) == before
+
+    for gs in playRandomGames(gamestateClass, visit):
+        start = gamestateClass()
+        start.default()
+
+        while gs.undoStack:
+            gs.unmakeMove()
+        assert getState(gs) == getState(start)
+
+@pytest.mark.parametrize("gamestateClass", gamestateClasses)
+@pytest.mark.parametrize("name, fen, counts", chessperft.perftPositions)
+def testPerft(gamestateClass, name, fen, counts):
+    gs = gamestateClass.fromFEN(fen)
+    for depth in range(1, min(3, len(counts)) + 1):
+        assert chessperft.perft(gs, depth) == counts[depth - 1]
+    assert gs.toFEN() == fen
+
+@pytest.mark.parametrize("gamestateClass", gamestateClasses)
+def testFenRoundTrip(gamestateClass):
+
+    def visit(gs, move):
+        fen = gs.toFEN()
+        new = gamestateClass.fromFEN(fen)
+        assert new.toFEN() == fen
+        assert new.getHash() == gs.getHash()
+        assert new.evalScore == gs.evalScore
+        checkIncremental(new)
+
+    for gs in playRandomGames(gamestateClass, visit):
+        pass
+
+def testLoadFENs():
+    fens = [fen for name, fen, counts in chessperft.perftPositions]
+    lines = ["# perft positions", ""] + fens[:-1] + [" ".join(fens[-1].split()[:4]) + ' id "last";']
+
+    loaded = [gs.toFEN() for gs in chess.loadFENs(io.StringIO("\n".join(lines)))]
+    assert [fen.split()[:4] for fen in loaded] == [fen.split()[:4] for fen in fens]
+
+# Cached legal moves against moves generated afresh
+@pytest.mark.parametrize("gamestateClass", gamestateClasses)
+def testLegalMoveCache(gamestateClass):
+
+    def visit(gs, move):
+        colour  = gs.getTurnPlayer()
+        moves   = [str(move) for move in gs.generateLegalMoves(colour)]
+
+        cached = gs.getLegalMoveList(colour)
+        assert [str(move) for move in cached] == moves
+        cached.clear()
+        assert [str(move) for move in gs.getLegalMoveList(colour)] == moves
+
+        moveMap = dict()
+        for move in gs.generateLegalMoves(colour):
+            fromIndex = chess.coordsToIndex(move.getFromPos())
+            moveMap[fromIndex] = moveMap.get(fromIndex, 0b0) | (0b1 << chess.coordsToIndex(move.getToPos()))
+        assert gs.getLegalMoveMap() == moveMap
+
+        oppColour = chess.invColour(colour)
+        assert [str(move) for move in gs.getLegalMoveList(oppColour)] ==\
+            [str(move) for move in gs.generateLegalMoves(oppColour)]
+
+    for gs in playRandomGames(gamestateClass, visit):
+        pass
+
+def testCompactGamestateMatches():
+    rand = random.Random(0)
+
+    for game in range(0, GAMES):
+        gs, compact = chess.Gamestate(), chess.CompactGamestate()
+        gs.default()
+        compact.default()
+
+        for ply in range(0, PLIES):
+            assert getState(compact) == getState(gs)
+
+            moves = gs.getLegalMoveList(gs.getTurnPlayer())
+            assert [str(move) for move in compact.getLegalMoveList(compact.getTurnPlayer())] ==\
+                [str(move) for move in moves]
+            if not moves:
+                break
+
+            move = rand.choice(moves)
+            gs.makeMove(move)
+            compact.makeMove(move)
+
+def testTranspositionTable():
+    table = chesstable.TranspositionTable(sizeMB=0.01)
+
+    # Keys a multiple of the bucket count apart share a bucket
+    keyA, keyB, keyC = 5, 5 + table.numBuckets, 5 + 2*table.numBuckets
+
+    assert table.probe(keyA) is None
+    table.store(keyA, 4, chesstable.EXACT, 10, 1)
+    assert table.probe(keyA) == (keyA, 4, chesstable.EXACT, 10, 1)
+
+    # A shallower entry goes to the always-replace slot, leaving the deeper one
+    table.store(keyB, 2, chesstable.LOWER, 20, 2)
+    table.store(keyC, 1, chesstable.UPPER, 30, 3)
+    assert table.probe(keyA) == (keyA, 4, chesstable.EXACT, 10, 1)
+    assert table.probe(keyB) is None
+    assert table.probe(keyC) == (keyC, 1, chesstable.UPPER, 30, 3)
+
+    # An entry at least as deep takes the depth-preferred slot
+    table.store(keyB, 4, chesstable.EXACT, 40, 4)
+    assert table.probe(keyA) is None
+    assert table.probe(keyB) == (keyB, 4, chesstable.EXACT, 40, 4)
+
+    # Storing without a move keeps the move already stored for the key
+    table.store(keyB, 5, chesstable.LOWER, 50)
+    assert table.probe(keyB) == (keyB, 5, chesstable.LOWER, 50, 4)
+    assert table.getStats()["overwrites"] == 2
+
+@pytest.mark.parametrize("gamestateClass", gamestateClasses)
+def testSearchFindsWin(gamestateClass):
+    # White wins by giving up its rook on the a-file or the 8th rank, where
+    # the black rook has to take it
+    gs = makePosition(gamestateClass, [(chess.WHITE | chess.ROOK, 7, 7), (chess.BLACK | chess.ROOK, 0, 0)])
+
+    result = chessbot.Searcher().search(gs, 3)
+    assert chessbot.isWinScore(result.getScore()) and result.getScore() > 0
+    assert result.getBestMove().getToPos() in [(0, 7), (7, 0)]
+
+# The black rook's forced capture lies past the horizon of a one ply search,
+# so only the capture search sees White win
+def testQuiescence():
+    gs = makePosition(chess.CompactGamestate, [(chess.WHITE | chess.ROOK, 7, 7), (chess.BLACK | chess.ROOK, 0, 0)])
+
+    result = chessbot.Searcher(quiescence=True).search(gs, 1)
+    assert chessbot.isWinScore(result.getScore()) and result.getScore() > 0
+    assert result.getBestMove().getToPos() in [(0, 7), (7, 0)]
+
+    result = chessbot.Searcher(quiescence=False).search(gs, 1)
+    assert not chessbot.isWinScore(result.getScore())
+
+# A stop from another thread ends a search with no time limit, and a stop
+# that comes first ends it before it searches at all
+def testSearchStop():
+    gs = chess.CompactGamestate()
+    gs.default()
+    moves = [str(move) for move in gs.getLegalMoveList(gs.getTurnPlayer())]
+
+    searcher = chessbot.Searcher()
+    timer = threading.Timer(0.05, searcher.stop)
+    timer.start()
+
+    startTime = time.perf_counter()
+    result = searcher.search(gs, chessbot.MAXDEPTH)
+    assert time.perf_counter() - startTime < 0.5
+    assert str(result.getBestMove()) in moves
+    timer.join()
+
+    searcher = chessbot.Searcher()
+    searcher.stop()
+    result = searcher.search(gs, chessbot.MAXDEPTH)
+    assert (result.getDepth(), result.getNodes()) == (0, 0)
+    assert str(result.getBestMove()) in moves
+
+def testMoveOrder():
+    whiteRook, whitePawn = chess.WHITE | chess.ROOK, chess.WHITE | chess.PAWN
+    gs = makePosition(chess.CompactGamestate, [(whiteRook, 0, 7), (whitePawn, 1, 6),
+                                               (chess.BLACK | chess.QUEEN, 0, 3), (chess.BLACK | chess.PAWN, 2, 5)])
+
+    takeQueen   = chess.Move(whiteRook, (0, 7), (0, 3))
+    takePawn    = chess.Move(whitePawn, (1, 6), (2, 5))
+    quietMoves  = [chess.Move(whiteRook, (0, 7), (0, 6)), chess.Move(whiteRook, (0, 7), (0, 4)),
+                   chess.Move(whitePawn, (1, 6), (1, 5))]
+
+    # Hash move, then captures by victim value, then killers
+    orderer = chessbot.MoveOrderer()
+    orderer.recordCutoff(gs, quietMoves[2], 0, 1)
+    assert orderer.orderMoves(gs, quietMoves + [takePawn, takeQueen], 0, chess.moveToCode(quietMoves[1])) ==\
+        [quietMoves[1], takeQueen, takePawn, quietMoves[2], quietMoves[0]]
+
+def testSearchTimeLimit():
+    gs = chess.CompactGamestate()
+    gs.default()
+    moves = [str(move) for move in gs.getLegalMoveList(gs.getTurnPlayer())]
+
+    startTime = time.perf_counter()
+    result = chessbot.Searcher().search(gs, timeMs=100)
+    assert time.perf_counter() - startTime < 0.5
+    assert str(result.getBestMove()) in moves
+
+    result = chessbot.Searcher().search(gs, 2)
+    assert result.getDepth() == 2
+    assert str(result.getBestMove()) in moves
+
+# canCapture and getCaptureMoveList against a square by square scan
+@pytest.mark.parametrize("gamestateClass", gamestateClasses)
+def testCaptures(gamestateClass):
+
+    def visit(gs, move):
+        for colour in chess.colourArray:
+            captures = []
+            for pieceType in chess.pieceArray:
+                for index in range(0, 64):
+                    if gs.getBits(pieceType | colour) & (0b1 << index):
+                        fromPos = chess.indexToCoords(index)
+                        captures += chess.bitsToMoveList(pieceType | colour, fromPos,
+                                                         gs.getCaptures(pieceType | colour, fromPos))
+
+            assert gs.canCapture(colour) == (len(captures) != 0)
+            assert sorted(str(move) for move in gs.getCaptureMoveList(colour)) ==\
+                sorted(str(move) for move in captures)
+
+    for gs in playRandomGames(gamestateClass, visit):
+        pass
+
+# Self-play games are legal, alternate colours and replay alone from their seed
+def testSelfplay():
+    results = sorted(chessselfplay.selfplay(4, "random", "search:1", workers=2, seed=7),
+                     key=lambda result: result.gameIndex)
+
+    for result in results:
+        assert (result.white, result.black) == (("random", "search:1") if result.gameIndex % 2 == 0 else
+                                               ("search:1", "random"))
+        replay = chessselfplay.playGame(result.white, result.black, result.seed, result.gameIndex)
+        assert (replay.getMoves(), replay.getOutcome()) == (result.getMoves(), result.getOutcome())
+
+        gs = chess.CompactGamestate()
+        gs.default()
+        for text in result.getMoves():
+            legalMoves = [chess.moveToCoordString(move) for move in gs.getLegalMoveList(gs.getTurnPlayer())]
+            assert text in legalMoves
+            gs.makeMove(chess.coordStringToMove(gs, text))
+
+def getRandomGames():
+    games = []
+    for game, gs in enumerate(playRandomGames(chess.CompactGamestate, lambda gs, move: None)):
+        moves = []
+        while gs.undoStack:
+            moves.append(chess.moveToCoordString(gs.undoStack[-1].getMove()))
+            gs.unmakeMove()
+
+        games.append(({"Event": "Test", "Round": str(game + 1)}, moves[::-1], chesspgn.RESULTS[game % 4]))
+
+    return games
+
+def testPgnRoundTrip():
+    games = getRandomGames()
+
+    pgnFile = io.StringIO()
+    assert chesspgn.writePgn(pgnFile, games) == len(games)
+    pgnFile.seek(0)
+
+    # Tags left out are written with their defaults
+    readGames = list(chesspgn.readPgn(pgnFile))
+    assert len(readGames) == len(games)
+    for (readHeaders, readMoves, readResult), (headers, moves, result) in zip(readGames, games):
+        assert headers.items() <= readHeaders.items()
+        assert (readMoves, readResult) == (moves, result)
+
+def testBinaryRoundTrip():
+    games = getRandomGames()
+
+    binFile = io.BytesIO()
+    assert chesspgn.writeBinary(binFile, games) == len(games)
+    binFile.seek(0)
+
+    assert list(chesspgn.readBinary(binFile)) == [(dict(), moves, result) for headers, moves, result in games]
+
+def getRandomPositions():
+    fens = []
+    for gs in playRandomGames(chess.CompactGamestate, lambda gs, move: fens.append(gs.toFEN())):
+        pass
+
+    return [chess.CompactGamestate.fromFEN(fen) for fen in fens]
+
+# Batched attacks and captures against the same found one position at a time
+def testBatchCaptures():
+    pytest.importorskip("numpy")
+    import chessbatch
+
+    positions   = getRandomPositions()
+    batch       = chessbatch.PositionBatch.fromGamestates(positions)
+
+    for colour in chess.colourArray:
+        pieceAttacks    = batch.pieceAttacks(colour)
+        canCapture      = batch.canCaptureColour(colour)
+
+        for i, gs in enumerate(positions):
+            occupancy   = gs.getBits(chess.BOTH | chess.ALL)
+            attacks     = 0b0
+            for pieceType in [chess.QUEEN, chess.KING, chess.ROOK, chess.BISHOP, chess.KNIGHT]:
+                for index in range(0, 64):
+                    if gs.getBits(pieceType | colour) & (0b1 << index):
+                        attacks |= cm.getAttacks(pieceType | colour, index, occupancy)
+
+            # The king tables also hold the king's own square
+            ownBits = gs.getBits(colour | chess.ALL)
+            assert int(pieceAttacks[i]) & ~ownBits == attacks & ~ownBits
+            assert bool(canCapture[i]) == gs.canCapture(colour)
+
+    assert [bool(canCapture) for canCapture in batch.canCapture()] ==\
+        [gs.canCapture(gs.getTurnPlayer()) for gs in positions]
+
+# Outcome of gs for the side to move as (1 win or -1 loss, plies), when it is
+# decided within depth plies, else None
+def solve(gs, depth):
+    moves = gs.getLegalMoveList(gs.getTurnPlayer())
+    if not moves:
+        return (1, 0)
+    if depth == 0:
+        return None
+
+    wins, losses, undecided = [], [], False
+    for move in moves:
+        gs.makeMove(move)
+        result = solve(gs, depth - 1)
+        gs.unmakeMove()
+
+        if result is None:
+            undecided = True
+        elif result[0] < 0:
+            wins.append(result[1] + 1)
+        else:
+            losses.append(result[1] + 1)
+
+    # A win can't be beaten, but a loss might be avoided by an undecided move
+    if wins:
+        return (1, min(wins))
+    if undecided:
+        return None
+    return (-1, max(losses))
+
+# Two piece tables against a search of every line a few plies deep
+@pytest.mark.parametrize("signature", ["KvR", "NvB", "QvN"])
+def testTablebase(tmp_path, signature):
+    chesstablebase.generateTable(signature, str(tmp_path))
+    tablebase   = chesstablebase.Tablebase(str(tmp_path))
+    rand        = random.Random(0)
+    maxDepth    = 3
+
+    for sample in range(0, 50):
+        squares = rand.sample(range(0, 64), 2)
+        pieces  = [(piece,) + chess.indexToCoords(index)
+                   for piece, index in zip(chesstablebase.signaturePieces(signature), squares)]
+        gs      = makePosition(chess.CompactGamestate, pieces, rand.choice(chess.colourArray))
+
+        result = tablebase.probe(gs)
+        if result[0] != 0 and result[1] <= maxDepth:
+            assert solve(gs, maxDepth) == result
+        else:
+            assert solve(gs, maxDepth) is None
+
+    tablebase.close()
+
+def testOpeningBook(tmp_path):
+    games       = getRandomGames()
+    bookPath    = str(tmp_path / "test.book")
+
+    with open(bookPath, "wb") as bookFile:
+        chessbook.writeBook(bookFile, chessbook.addGames(games))
+    book = chessbook.OpeningBook(bookPath)
+
+    # First moves weighted by the points of the games they were played in
+    weights = dict()
+    for headers, moves, result in games:
+        points = {"1-0": chessbook.WINPOINTS, "1/2-1/2": chessbook.DRAWPOINTS}.get(result, 0)
+        weights[moves[0]] = weights.get(moves[0], 0) + points
+
+    gs = chess.CompactGamestate()
+    gs.default()
+    legalMoves = [chess.moveToCoordString(move) for move in gs.getLegalMoveList(gs.getTurnPlayer())]
+
+    bookMoves = [(chess.moveToCoordString(move), weight) for move, weight in book.getMoves(gs)]
+    assert dict(bookMoves) == {text: weight for text, weight in weights.items() if weight > 0}
+    bookWeights = [weight for text, weight in bookMoves]
+    assert bookWeights == sorted(bookWeights, reverse=True)
+    assert chess.moveToCoordString(book.getMove(gs)) in legalMoves
+
+    # A position out of the book
+    gs.makeMove(chess.coordStringToMove(gs, "a2a3"))
+    gs.makeMove(chess.coordStringToMove(gs, "a7a6"))
+    gs.makeMove(chess.coordStringToMove(gs, "h2h3"))
+    assert book.getMove(gs) is None
+
+    book.close()
+
+def testEvaluateMany():
+    pytest.importorskip("numpy")
+
+    positions = getRandomPositions()
+    assert list(chesseval.evaluateMany(positions)) == [chesseval.evaluate(gs) for gs in positions]
+
+def testParallelSearch():
+    start = chess.CompactGamestate()
+    start.default()
+    moves = [str(move) for move in start.getLegalMoveList(start.getTurnPlayer())]
+
+    win = makePosition(chess.CompactGamestate, [(chess.WHITE | chess.ROOK, 7, 7), (chess.BLACK | chess.ROOK, 0, 0)])
+
+    with chessparallel.ParallelSearcher(workers=2) as searcher:
+        result = searcher.search(start, 2)
+        assert result.getDepth() == 2
+        assert str(result.getBestMove()) in moves
+
+        startTime = time.perf_counter()
+        result = searcher.search(start, timeMs=100)
+        assert time.perf_counter() - startTime < 0.5
+        assert str(result.getBestMove()) in moves
+
+        result = searcher.search(win, 3)
+        assert chessbot.isWinScore(result.getScore()) and result.getScore() > 0
+        assert result.getBestMove().getToPos() in [(0, 7), (7, 0)]